@@ -0,0 +1,146 @@
+# Seeds a local database with synthetic users, sessions, messages and files, then times the
+# app's hot queries and prints their plans without and with the indexes of SCHEMA_MIGRATIONS.
+#
+#   python benchmark_queries.py                        # SQLite file in the temp directory
+#   python benchmark_queries.py postgresql://localhost/benchmark --users 500
+#
+# Never point it at a real database: it drops and recreates the hot-path indexes.
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.insert(0, project_root)
+
+parser = argparse.ArgumentParser(description="Benchmark the hot database queries with and without their indexes.")
+parser.add_argument('database_url', nargs='?', default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'benchmark_queries.db')}")
+parser.add_argument('--users', type=int, default=200)
+parser.add_argument('--sessions-per-user', type=int, default=50)
+parser.add_argument('--turns-per-session', type=int, default=20)
+parser.add_argument('--repeat', type=int, default=50, help="Runs of each query per measurement")
+args = parser.parse_args()
+
+# ui connects to DATABASE_URL on import, so point it at the benchmark database first
+os.environ['DATABASE_URL'] = args.database_url
+from ui import app, db, User, ChatSession, ChatMessage, GeneratedFile, DataSource, HOT_PATH_INDEXES, _create_indexes
+from sqlalchemy import select, insert, text as sqlalchemy_text
+
+
+def seed():
+    """Fill an empty database; each turn is a user message, a text answer and a file message."""
+    if db.session.query(User.id).first():
+        print("Database already seeded, reusing it.")
+        return
+    print(f"Seeding {args.users} users x {args.sessions_per_user} sessions x {args.turns_per_session} turns...")
+    started = time.perf_counter()
+    start_time = datetime(2024, 1, 1)
+    db.session.execute(insert(User), [{"email": f"user{u}@example.com", "password": "x"} for u in range(args.users)])
+    user_ids = [row.id for row in db.session.execute(select(User.id))]
+
+    db.session.execute(insert(DataSource), [
+        {"user_id": user_id, "original_filename": f"data{d}.csv", "storage_path": f"uploads/{user_id}/{d}.csv",
+         "created_at": start_time + timedelta(minutes=d)}
+        for user_id in user_ids for d in range(10)])
+
+    # Interleave users so each user's rows are spread over the tables, as in production
+    session_rows = [{"user_id": user_id, "session_title": f"Chat {s}",
+                     "created_at": start_time + timedelta(hours=s), "updated_at": start_time + timedelta(hours=s, minutes=random.randint(0, 600))}
+                    for s in range(args.sessions_per_user) for user_id in user_ids]
+    db.session.execute(insert(ChatSession), session_rows)
+    session_ids = [row.id for row in db.session.execute(select(ChatSession.id))]
+
+    file_rows, message_rows = [], []
+    for turn in range(args.turns_per_session):
+        for session_id in session_ids:
+            file_rows.append({"chat_session_id": session_id, "original_prompt": f"question {turn}", "file_type": "png",
+                              "storage_path": f"generated/{session_id}/{turn}.png"})
+    for i in range(0, len(file_rows), 10000):
+        db.session.execute(insert(GeneratedFile), file_rows[i:i + 10000])
+    file_ids = [row.id for row in db.session.execute(select(GeneratedFile.id).order_by(GeneratedFile.id))]
+
+    for turn in range(args.turns_per_session):
+        for position, session_id in enumerate(session_ids):
+            timestamp = start_time + timedelta(minutes=turn)
+            file_id = file_ids[turn * len(session_ids) + position]
+            message_rows += [
+                {"session_id": session_id, "message_type": "user", "message_content": f"question {turn}", "timestamp": timestamp},
+                {"session_id": session_id, "message_type": "bot", "message_content": f"answer {turn}", "timestamp": timestamp},
+                {"session_id": session_id, "message_type": "bot", "message_content": str(file_id), "timestamp": timestamp,
+                 "is_file_info": True},
+            ]
+    for i in range(0, len(message_rows), 10000):
+        db.session.execute(insert(ChatMessage), message_rows[i:i + 10000])
+    db.session.commit()
+    print(f"Seeded {len(message_rows)} messages and {len(file_rows)} files in {time.perf_counter() - started:.1f}s")
+
+
+def hot_queries():
+    """The queries behind the chat page, with parameters from the middle of the data."""
+    user_count = db.session.query(User.id).count()
+    user_id = db.session.execute(select(User.id).order_by(User.id).offset(user_count // 2).limit(1)).scalar()
+    session_id = db.session.execute(select(ChatSession.id).where(ChatSession.user_id == user_id).limit(1)).scalar()
+    last_message_id = db.session.execute(select(ChatMessage.id).where(ChatMessage.session_id == session_id)
+                                         .order_by(ChatMessage.id.desc()).limit(1)).scalar()
+    return {
+        "session list (initial-data)": select(ChatSession).where(ChatSession.user_id == user_id).order_by(ChatSession.updated_at.desc()),
+        "session list (sessions)": select(ChatSession).where(ChatSession.user_id == user_id).order_by(ChatSession.created_at.desc()),
+        "data sources": select(DataSource).where(DataSource.user_id == user_id).order_by(DataSource.created_at.desc()),
+        "full history": select(ChatMessage).where(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp.asc()),
+        "history page": select(ChatMessage).where(ChatMessage.session_id == session_id, ChatMessage.id < last_message_id)
+                        .order_by(ChatMessage.id.desc()).limit(51),
+        "session files": select(GeneratedFile).where(GeneratedFile.chat_session_id == session_id),
+    }
+
+
+def explain(statement):
+    sql = str(statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(sqlalchemy_text(prefix + sql)).fetchall()
+    return [str(row[-1]) for row in rows]
+
+
+def measure(label):
+    print(f"\n=== {label} ===")
+    timings = {}
+    for name, statement in hot_queries().items():
+        db.session.execute(statement).fetchall()  # Warm up the cache
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            db.session.execute(statement).fetchall()
+        timings[name] = (time.perf_counter() - started) / args.repeat * 1000
+        print(f"{name}: {timings[name]:.3f} ms")
+        for line in explain(statement):
+            print(f"    {line}")
+    return timings
+
+
+def main():
+    with app.app_context():
+        seed()
+        for index_name in HOT_PATH_INDEXES:
+            db.session.execute(sqlalchemy_text(f'DROP INDEX IF EXISTS {index_name}'))
+        db.session.execute(sqlalchemy_text('ANALYZE'))
+        db.session.commit()
+        db.engine.dispose()
+        before = measure("Without the hot-path indexes")
+
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            _create_indexes(connection, *HOT_PATH_INDEXES)
+            connection.execute(sqlalchemy_text('ANALYZE'))
+        # Start over on fresh connections, so no planner state from before the indexes is reused
+        db.engine.dispose()
+        after = measure("With the hot-path indexes")
+
+        print("\nquery | without (ms) | with (ms) | speedup")
+        for name in before:
+            print(f"{name} | {before[name]:.3f} | {after[name]:.3f} | {before[name] / max(after[name], 1e-6):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
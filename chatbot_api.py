@@ -1,78 +1,235 @@
 import os
 import google.generativeai as genai
-from flask import request, jsonify
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.rpc import error_details_pb2
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg')  # Use a non-interactive backend for Matplotlib
-import matplotlib.pyplot as plt
 import io
 import uuid
 import boto3
 import json
 import time
+import bisect
+import hashlib
+import hmac
+import itertools
+import math
+import re
+import random
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from typing import Optional
 import uuid
-from ui import db, GeneratedFile, app, ChatMessage
+from botocore.exceptions import ClientError
+from ui import db, GeneratedFile, app, ChatMessage, DataSource, ChatJob, CachedCode, CachedResult, build_data_profile
+from ui import OUT_OF_CORE_THRESHOLD_BYTES, OUT_OF_CORE_CHUNK_ROWS, CHATBOT_API_MODE
+from code_executor import CodeExecutorPool, execute_analysis, read_frame, chunk_reader, SHALLOW_COPY_IS_SAFE
 
 
 # --- CONFIGURATION ---
+# Default quota of each Google API key; a key can override them as "key:rpm:tpm" in GOOGLE_API_KEY
+GEMINI_KEY_RPM = int(os.environ.get('GEMINI_KEY_RPM', 15))
+GEMINI_KEY_TPM = int(os.environ.get('GEMINI_KEY_TPM', 1_000_000))
+# How long a call waits for a key with quota left before trying the least-loaded key anyway
+GEMINI_KEY_WAIT_SECONDS = float(os.environ.get('GEMINI_KEY_WAIT_SECONDS', 30))
+# How long a key is left alone after a rate-limit error
+GEMINI_KEY_COOLDOWN_SECONDS = float(os.environ.get('GEMINI_KEY_COOLDOWN_SECONDS', 60))
+
+
+class _TokenBucket:
+    """Refills continuously up to `capacity` at `capacity` per minute."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """Seconds until `amount` (capped at the capacity) can be taken."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float):
+        # May go negative when actual usage exceeds the estimate; the debt delays the next call
+        self.level -= amount
+
+
+class _KeyState:
+    """Quota bookkeeping for one API key."""
+
+    def __init__(self, key: str, requests_per_minute: int, tokens_per_minute: int):
+        self.key = key
+        self.requests = _TokenBucket(requests_per_minute)
+        self.tokens = _TokenBucket(tokens_per_minute)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+    def spare_quota(self) -> float:
+        """Fraction of the tighter of the two quotas that is still available."""
+        return min(self.requests.level / self.requests.capacity, self.tokens.level / self.tokens.capacity)
+
+
+class APIKeysCoolingDown(Exception):
+    """Every API key a call could use is cooling down after a rate limit or rejection."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Every API key is cooling down after a rate limit; retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
 class GoogleAPIKeyManager:
-    def __init__(self, api_keys_string: str):
+    """
+    Thread-safe scheduler over several Google API keys. Each key has token buckets sized to its
+    requests-per-minute and tokens-per-minute quota. acquire() hands out the key with the most
+    spare quota, waiting if every key is exhausted, so load is spread before a 429 ever happens;
+    a key that is rate limited anyway cools down before it is used again.
+    """
+
+    def __init__(self, api_keys_string: str, requests_per_minute: int, tokens_per_minute: int):
         """Initialize with comma-separated API keys string"""
-        self.api_keys = [key.strip() for key in api_keys_string.split(',') if key.strip()]
-        self.current_key_index = 0
-        self.failed_keys = set()  # Track temporarily failed keys
-        self.last_reset_time = time.time()
-        self.reset_interval = 12600  # Reset failed keys every 6 hours
-        
-        if not self.api_keys:
+        self._keys = []
+        for entry in api_keys_string.split(','):
+            key, _, quota = entry.strip().partition(':')
+            if not key:
+                continue
+            rpm, _, tpm = quota.partition(':')
+            self._keys.append(_KeyState(key, int(rpm or requests_per_minute), int(tpm or tokens_per_minute)))
+        self._condition = threading.Condition()
+
+        if not self._keys:
             raise ValueError("No valid API keys provided")
-        
-        print(f"Initialized with {len(self.api_keys)} Google API keys")
-    
-    def get_current_key(self) -> str:
-        """Get the current API key"""
-        self._reset_failed_keys_if_needed()
-        return self.api_keys[self.current_key_index]
-    
-    def rotate_key(self) -> bool:
-        """Rotate to the next available API key. Returns True if rotation successful."""
-        self._reset_failed_keys_if_needed()
-        
-        # Mark current key as failed
-        current_key = self.api_keys[self.current_key_index]
-        self.failed_keys.add(current_key)
-        print(f"Marking API key ending in ...{current_key[-4:]} as temporarily failed")
-        
-        # Find next available key
-        start_index = self.current_key_index
-        for _ in range(len(self.api_keys)):
-            self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-            current_key = self.api_keys[self.current_key_index]
-            
-            if current_key not in self.failed_keys:
-                print(f"Rotated to API key ending in ...{current_key[-4:]}")
-                return True
-        
-        # If all keys are failed, reset and try again
-        print("All API keys are temporarily failed, resetting...")
-        self.failed_keys.clear()
-        self.current_key_index = (start_index + 1) % len(self.api_keys)
-        return True
-    
-    def _reset_failed_keys_if_needed(self):
-        """Reset failed keys if enough time has passed"""
-        current_time = time.time()
-        if current_time - self.last_reset_time > self.reset_interval:
-            if self.failed_keys:
-                print(f"Resetting {len(self.failed_keys)} failed API keys after {self.reset_interval} seconds")
-                self.failed_keys.clear()
-            self.last_reset_time = current_time
-    
+
+        print(f"Initialized with {len(self._keys)} Google API keys")
+
+    def acquire(self, estimated_tokens: int, timeout: float = GEMINI_KEY_WAIT_SECONDS) -> str:
+        """
+        Reserve quota for one call on the least-loaded key. Pair with release(). After `timeout`, a key
+        whose quota only looks used up is taken anyway; keys cooling down never are, and if those are
+        all that's left this raises APIKeysCoolingDown rather than earn another 429.
+        """
+        return self._acquire(self._keys, estimated_tokens, timeout, force=True)
+
+    def try_acquire(self, estimated_tokens: int, exclude: str) -> Optional[str]:
+        """Like acquire(), but only on a key other than `exclude` with quota left right now; None otherwise."""
+        return self._acquire([state for state in self._keys if state.key != exclude], estimated_tokens, 0, force=False)
+
+    def _acquire(self, candidates: list, estimated_tokens: int, timeout: float, force: bool) -> Optional[str]:
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                best, wait = None, None
+                for state in candidates:
+                    state.requests.refill(now)
+                    state.tokens.refill(now)
+                    if state.cooldown_until > now:
+                        delay = state.cooldown_until - now
+                    else:
+                        delay = max(state.requests.seconds_until(1), state.tokens.seconds_until(estimated_tokens))
+                    if delay > 0:
+                        wait = delay if wait is None else min(wait, delay)
+                    elif best is None or (state.spare_quota(), -state.in_flight) > (best.spare_quota(), -best.in_flight):
+                        best = state
+
+                if best is None and now >= deadline:
+                    if not force or not candidates:
+                        return None
+                    usable = [state for state in candidates if state.cooldown_until <= now]
+                    if not usable:
+                        raise APIKeysCoolingDown(min(state.cooldown_until for state in candidates) - now)
+                    best = min(usable, key=lambda state: state.in_flight)
+                    print(f"No API key has quota left after {timeout:g}s, using key ending in ...{best.key[-4:]} anyway")
+                if best is not None:
+                    best.requests.take(1)
+                    best.tokens.take(min(estimated_tokens, best.tokens.capacity))
+                    best.in_flight += 1
+                    return best.key
+                self._condition.wait(min(wait, deadline - now))
+
+    def release(self, key: str, estimated_tokens: int = 0, tokens_used: Optional[int] = None):
+        """End a call started with acquire(), correcting the token estimate with actual usage if known."""
+        with self._condition:
+            state = self._state(key)
+            state.in_flight -= 1
+            if tokens_used is not None:
+                state.tokens.take(tokens_used - min(estimated_tokens, state.tokens.capacity))
+            self._condition.notify_all()
+
+    def report_rate_limited(self, key: str, retry_after: Optional[float] = None):
+        """Stop handing out a key that hit a rate limit until it has cooled down (for `retry_after` if the server said)."""
+        self.cool_down(key, retry_after if retry_after is not None else GEMINI_KEY_COOLDOWN_SECONDS, "was rate limited")
+
+    def cool_down(self, key: str, seconds: float, reason: str):
+        """Stop handing out a key for `seconds`."""
+        with self._condition:
+            state = self._state(key)
+            state.cooldown_until = max(state.cooldown_until, time.monotonic() + seconds)
+            state.requests.level = min(state.requests.level, 0)
+        print(f"API key ending in ...{key[-4:]} {reason}, cooling down for {seconds:g}s")
+
     def get_available_keys_count(self) -> int:
-        """Get count of currently available (non-failed) keys"""
-        self._reset_failed_keys_if_needed()
-        return len(self.api_keys) - len(self.failed_keys)
+        """Get count of keys that are not cooling down after a rate limit"""
+        now = time.monotonic()
+        with self._condition:
+            return sum(1 for state in self._keys if state.cooldown_until <= now)
+
+    def snapshot(self) -> dict:
+        """Current quota and load of each key, by the key's last 4 characters."""
+        now = time.monotonic()
+        with self._condition:
+            keys = {}
+            for state in self._keys:
+                state.requests.refill(now)
+                state.tokens.refill(now)
+                keys[f"...{state.key[-4:]}"] = {
+                    "requests_left": round(state.requests.level, 2),
+                    "requests_per_minute": state.requests.capacity,
+                    "tokens_left": round(state.tokens.level),
+                    "tokens_per_minute": state.tokens.capacity,
+                    "in_flight": state.in_flight,
+                    "cooldown_seconds": round(max(0.0, state.cooldown_until - now), 1)
+                }
+            return keys
+
+    def _state(self, key: str) -> _KeyState:
+        return next(state for state in self._keys if state.key == key)
+
+class GeminiModelRegistry:
+    """
+    One GenerativeServiceClient per API key and one GenerativeModel per (key, model name), built
+    on first use and then reused, so calls on a key share its connection and never depend on the
+    process-wide genai.configure() state.
+    """
+
+    def __init__(self):
+        self._clients = {}  # api_key -> GenerativeServiceClient
+        self._models = {}  # (api_key, model_name) -> GenerativeModel
+        self._lock = threading.Lock()
+
+    def get_model(self, api_key: str, model_name: str) -> genai.GenerativeModel:
+        with self._lock:
+            model = self._models.get((api_key, model_name))
+            if model is None:
+                client = self._clients.get(api_key)
+                if client is None:
+                    client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+                    self._clients[api_key] = client
+                model = genai.GenerativeModel(model_name)
+                # GenerativeModel otherwise falls back to the default client of genai.configure()
+                model._client = client
+                self._models[(api_key, model_name)] = model
+            return model
+
+
+gemini_models = GeminiModelRegistry()
 
 # Initialize API Key Manager
 try:
@@ -80,8 +237,7 @@ try:
     if not GOOGLE_API_KEYS_STRING:
         raise ValueError("GOOGLE_API_KEY environment variable is required")
     
-    api_key_manager = GoogleAPIKeyManager(GOOGLE_API_KEYS_STRING)
-    genai.configure(api_key=api_key_manager.get_current_key())
+    api_key_manager = GoogleAPIKeyManager(GOOGLE_API_KEYS_STRING, GEMINI_KEY_RPM, GEMINI_KEY_TPM)
 except Exception as e:
     print(f"Error configuring Google AI: {e}")
     exit()
@@ -102,85 +258,1110 @@ if R2_ACCOUNT_ID and R2_ACCESS_KEY_ID and R2_SECRET_ACCESS_KEY:
     )
 
 
+
+# --- DATA SOURCE CACHE ---
+# Memory budget (bytes) for parsed data sources kept in this worker. 0 disables the cache.
+DATAFRAME_CACHE_MAX_BYTES = int(os.environ.get('DATAFRAME_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+
+class DataFrameCache:
+    """In-process LRU cache of parsed data sources, keyed by storage path and R2 ETag."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()  # storage_path -> (etag, DataFrame, size_in_bytes)
+        self._lock = threading.Lock()
+
+    def get(self, storage_path: str) -> Optional[tuple[str, pd.DataFrame]]:
+        """Return (etag, DataFrame) for a cached path and mark it as recently used."""
+        with self._lock:
+            entry = self._entries.get(storage_path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(storage_path)
+            return entry[0], entry[1]
+
+    def put(self, storage_path: str, etag: str, df: pd.DataFrame):
+        """Cache a parsed DataFrame, evicting least recently used entries to stay within budget."""
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            self._discard(storage_path)
+            if size > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                evicted_path, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                print(f"Evicted data source '{evicted_path}' from cache ({evicted_size} bytes)")
+            self._entries[storage_path] = (etag, df, size)
+            self.current_bytes += size
+
+    def invalidate(self, storage_path: str):
+        with self._lock:
+            self._discard(storage_path)
+
+    def _discard(self, storage_path: str):
+        entry = self._entries.pop(storage_path, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+
+dataframe_cache = DataFrameCache(DATAFRAME_CACHE_MAX_BYTES)
+
+
+# --- SHARED DISK CACHE ---
+# Node-local copies of R2 objects shared by every worker on the machine. 0 disables the tier.
+R2_DISK_CACHE_DIR = os.environ.get('R2_DISK_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'r2-object-cache'))
+R2_DISK_CACHE_MAX_BYTES = int(os.environ.get('R2_DISK_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+
+
+class DiskObjectCache:
+    """
+    On-disk cache of R2 objects, content-addressed by ETag so workers never see a
+    stale or partial file: downloads go to a temporary file that is atomically
+    renamed into place. Eviction is least-recently-used by mtime, bounded in size.
+    """
+
+    TEMP_PREFIX = '.tmp-'
+    STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path_for(self, etag: str) -> str:
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9-]', '', etag))
+
+    def get(self, etag: str) -> Optional[str]:
+        """
+        Return the local path for an ETag if it is cached, marking it as recently used. Another
+        worker may still evict it before it is opened; see open_from_disk_cache.
+        """
+        path = self.path_for(etag)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put(self, etag: str, body) -> str:
+        """Stream a file-like body into the cache under its ETag and return the local path."""
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=self.TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                shutil.copyfileobj(body, temp_file, 1024 * 1024)
+            path = self.path_for(etag)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: str):
+        """
+        Delete least recently used files until the cache fits its budget, never the file
+        just written (`keep`), which is about to be read. Safe to race with other workers.
+        """
+        entries = []
+        kept_bytes = 0
+        now = time.time()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                    if entry.name.startswith(self.TEMP_PREFIX):
+                        # Left behind by a worker that died mid-download
+                        if now - stat.st_mtime > self.STALE_TEMP_SECONDS:
+                            os.remove(entry.path)
+                        continue
+                    if entry.path != keep:
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    else:
+                        kept_bytes = stat.st_size
+                except FileNotFoundError:
+                    continue
+
+        total_bytes = kept_bytes + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                # Workers that already mapped the file keep reading it until they close it
+                os.remove(path)
+                print(f"Evicted {path} from disk cache ({size} bytes)")
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+
+disk_cache = DiskObjectCache(R2_DISK_CACHE_DIR, R2_DISK_CACHE_MAX_BYTES)
+
+
+def fetch_to_disk_cache(storage_path: str, etag: Optional[str] = None) -> tuple[str, str]:
+    """
+    Return (etag, local_path) for the current version of an R2 object, downloading it
+    into the shared disk cache only if no worker on this node has fetched it yet.
+    """
+    if etag is None:
+        etag = s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=storage_path)['ETag']
+    path = disk_cache.get(etag)
+    if path:
+        return etag, path
+    obj = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=storage_path)
+    return obj['ETag'], disk_cache.put(obj['ETag'], obj['Body'])
+
+
+def open_from_disk_cache(storage_path: str, opener, etag: Optional[str] = None):
+    """
+    Return (etag, opener(local_path)) for an R2 object fetched into the disk cache. If another
+    worker evicts the file before opener has it open, that counts as a miss: it is fetched again.
+    """
+    etag, path = fetch_to_disk_cache(storage_path, etag)
+    try:
+        return etag, opener(path)
+    except FileNotFoundError:
+        print(f"'{storage_path}' was evicted from the disk cache before it was opened, fetching it again")
+        obj = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=storage_path)
+        return obj['ETag'], opener(disk_cache.put(obj['ETag'], obj['Body']))
+
+
+def _is_not_modified(error: ClientError) -> bool:
+    """True if a conditional request was answered with 304 Not Modified."""
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    code = error.response.get('Error', {}).get('Code')
+    return status == 304 or code in ('304', 'NotModified')
+
+
+def _read_object(storage_path: str, file_format: str) -> pd.DataFrame:
+    """
+    Read one R2 object ('csv' or 'parquet') into a DataFrame. A cached copy is only served after
+    a conditional HEAD confirms its ETag is still current; otherwise the object is re-read
+    from the shared disk cache, or from R2 if this node doesn't have that version yet.
+    The returned frame is a private copy that generated code may freely modify.
+    """
+    current_etag = None
+    cached = dataframe_cache.get(storage_path) if DATAFRAME_CACHE_MAX_BYTES > 0 else None
+    if cached:
+        cached_etag, cached_df = cached
+        try:
+            head = s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=storage_path, IfNoneMatch=cached_etag)
+            # A 200 means the object changed since it was cached
+            current_etag = head['ETag']
+            dataframe_cache.invalidate(storage_path)
+        except ClientError as e:
+            if not _is_not_modified(e):
+                dataframe_cache.invalidate(storage_path)
+                raise
+            print(f"Serving data source '{storage_path}' from cache (ETag {cached_etag})")
+            return cached_df.copy(deep=not SHALLOW_COPY_IS_SAFE)
+
+    if disk_cache.enabled:
+        etag, df = open_from_disk_cache(storage_path, lambda path: read_frame(path, file_format), current_etag)
+    else:
+        obj = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=storage_path)
+        etag, df = obj['ETag'], read_frame(io.BytesIO(obj['Body'].read()), file_format)
+    if DATAFRAME_CACHE_MAX_BYTES > 0:
+        dataframe_cache.put(storage_path, etag, df)
+        return df.copy(deep=not SHALLOW_COPY_IS_SAFE)
+    return df
+
+
+def load_data_source(storage_path: str, columnar_path: Optional[str] = None) -> pd.DataFrame:
+    """
+    Load a data source as a DataFrame, preferring its Parquet copy (typed, no CSV
+    parsing) and falling back to the original CSV if there is none or it can't be read.
+    """
+    if columnar_path:
+        try:
+            return _read_object(columnar_path, 'parquet')
+        except Exception as e:
+            print(f"Could not read columnar copy '{columnar_path}', falling back to CSV: {e}")
+    return _read_object(storage_path, 'csv')
+
+
+# --- OUT-OF-CORE MODE ---
+# OUT_OF_CORE_THRESHOLD_BYTES and OUT_OF_CORE_CHUNK_ROWS come from ui, which also uses them at upload
+
+
+def inspect_data_source(storage_path: str) -> tuple[str, bool]:
+    """
+    HEAD a data source and return (etag, out_of_core), where out_of_core is True if
+    it is too large to be materialized in worker memory.
+    """
+    head = s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=storage_path)
+    out_of_core = OUT_OF_CORE_THRESHOLD_BYTES > 0 and head['ContentLength'] > OUT_OF_CORE_THRESHOLD_BYTES
+    return head['ETag'], out_of_core
+
+
+def open_chunked_data_source(storage_path: str, columnar_path: Optional[str] = None):
+    """
+    Return a `read_chunks()` function for out-of-core mode. Each call yields the data
+    source from the start as DataFrames of at most OUT_OF_CORE_CHUNK_ROWS rows, so memory
+    use is bounded by the chunk size rather than the file size.
+    """
+    if not disk_cache.enabled:
+        def read_chunks_from_r2():
+            body = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=storage_path)['Body']
+            yield from pd.read_csv(body, chunksize=OUT_OF_CORE_CHUNK_ROWS)
+        return read_chunks_from_r2
+
+    if columnar_path:
+        try:
+            # The Parquet file is opened here, so it stays readable even if it is evicted later
+            _, read_chunks = open_from_disk_cache(columnar_path, lambda path: chunk_reader(path, 'parquet', OUT_OF_CORE_CHUNK_ROWS))
+            return read_chunks
+        except Exception as e:
+            print(f"Could not open columnar copy '{columnar_path}', falling back to CSV: {e}")
+
+    _, csv_path = fetch_to_disk_cache(storage_path)
+    return chunk_reader(csv_path, 'csv', OUT_OF_CORE_CHUNK_ROWS)
+
+
+# --- CODE EXECUTOR POOL ---
+# Processes that run generated code outside the web worker. 0 runs it in the web worker itself.
+# The pool reads data sources from the shared disk cache, so it requires that tier to be enabled.
+CODE_EXECUTOR_POOL_SIZE = int(os.environ.get('CODE_EXECUTOR_POOL_SIZE', 0))
+CODE_EXECUTOR_TIMEOUT_SECONDS = float(os.environ.get('CODE_EXECUTOR_TIMEOUT_SECONDS', 120))
+CODE_EXECUTOR_MEMORY_LIMIT_BYTES = int(os.environ.get('CODE_EXECUTOR_MEMORY_LIMIT_BYTES', 8 * 1024 ** 3))
+CODE_EXECUTOR_MAX_JOBS = int(os.environ.get('CODE_EXECUTOR_MAX_JOBS', 100))
+
+code_executor_pool = None
+if CODE_EXECUTOR_POOL_SIZE > 0:
+    if disk_cache.enabled:
+        code_executor_pool = CodeExecutorPool(CODE_EXECUTOR_POOL_SIZE, CODE_EXECUTOR_TIMEOUT_SECONDS,
+                                              CODE_EXECUTOR_MEMORY_LIMIT_BYTES, CODE_EXECUTOR_MAX_JOBS)
+    else:
+        print("CODE_EXECUTOR_POOL_SIZE is set but the disk cache is disabled; running generated code in-process")
+
+
+def fetch_dataset_reference(storage_path: str, columnar_path: Optional[str], out_of_core: bool) -> dict:
+    """
+    Make sure a data source is in the shared disk cache and describe it for an executor
+    process, which loads it from there itself. Prefers the Parquet copy, like load_data_source.
+    """
+    reference = {"out_of_core": out_of_core, "chunk_rows": OUT_OF_CORE_CHUNK_ROWS}
+    if columnar_path:
+        try:
+            _, path = fetch_to_disk_cache(columnar_path)
+            return {**reference, "path": path, "format": "parquet"}
+        except Exception as e:
+            print(f"Could not fetch columnar copy '{columnar_path}', falling back to CSV: {e}")
+    _, path = fetch_to_disk_cache(storage_path)
+    return {**reference, "path": path, "format": "csv"}
+
+
+# Background threads that load data sources while the LLM writes the analysis code
+data_loader_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('DATA_LOADER_THREADS', 4)),
+                                          thread_name_prefix='data-loader')
+
+
+# Background threads that upload generated files and write their intro messages
+artifact_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ARTIFACT_THREADS', 8)),
+                                       thread_name_prefix='artifact')
+
+
+# Bytes fetched to infer the schema of a data source that has no stored profile; the range grows
+# up to HEADER_MAX_READ_BYTES if it doesn't hold a whole line
+HEADER_READ_BYTES = 64 * 1024
+HEADER_MAX_READ_BYTES = 4 * 1024 * 1024
+
+
+def read_data_source_header(storage_path: str) -> dict:
+    """
+    Build a partial profile (column names, inferred dtypes, sample rows) from a ranged
+    GET of the start of a CSV, so code generation doesn't wait for the full download.
+    """
+    read_bytes = HEADER_READ_BYTES
+    while True:
+        obj = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=storage_path, Range=f"bytes=0-{read_bytes - 1}")
+        head = obj['Body'].read()
+        total_size = int(obj.get('ContentRange', '').rpartition('/')[2] or len(head))
+        if total_size <= len(head):
+            break
+        last_newline = head.rfind(b'\n')
+        if last_newline >= 0:
+            # Drop the row cut off by the range
+            head = head[:last_newline + 1]
+            break
+        if read_bytes >= HEADER_MAX_READ_BYTES:
+            raise ValueError(f"The first {read_bytes} bytes of the data source hold no complete line")
+        read_bytes *= 4
+    return build_data_profile(pd.read_csv(io.BytesIO(head)), column_stats=False)
+
+
+# Data sources whose profile this worker is storing, so concurrent turns on one of them store it once
+_profiles_being_stored = set()
+_profiles_being_stored_lock = threading.Lock()
+
+
+def store_data_profile(storage_path: str, df: pd.DataFrame):
+    """
+    Save a full profile, built from the turn's loaded DataFrame, for a data source uploaded
+    before profiling existed, so later turns can skip the header read. Runs in the background.
+    """
+    with _profiles_being_stored_lock:
+        if storage_path in _profiles_being_stored:
+            return
+        _profiles_being_stored.add(storage_path)
+    try:
+        with app.app_context():
+            try:
+                data_source = DataSource.query.filter_by(storage_path=storage_path).first()
+                if data_source and not data_source.profile:
+                    data_source.profile = json.dumps(build_data_profile(df))
+                    db.session.commit()
+                    print(f"Stored profile for data source '{storage_path}'")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Could not store profile for data source '{storage_path}': {e}")
+    finally:
+        with _profiles_being_stored_lock:
+            _profiles_being_stored.discard(storage_path)
+
+
+def _describe_column(column: dict) -> str:
+    line = f"- {column['name']} | {column['dtype']}"
+    if 'null_count' in column:
+        distinct = f"{column['distinct_count']}+" if column.get('distinct_count_capped') else column['distinct_count']
+        line += f" | {column['null_count']} nulls | {distinct} distinct"
+    if 'min' in column:
+        line += f" | {column['min']} to {column['max']}"
+    return line
+
+
+def _describe_sample_rows(profile: dict, column_names: list) -> list:
+    lines = ["Sample rows:"]
+    for row in profile['sample_rows']:
+        # Keep the dataset's column order even if the JSON round-trip sorted the keys
+        lines.append(json.dumps({name: row.get(name) for name in column_names}, default=str))
+    return lines
+
+
+def describe_data_profile(profile: dict, question: Optional[str] = None) -> str:
+    """
+    Render a data source profile (see ui.build_data_profile) as prompt text. If that would
+    exceed SCHEMA_TOKEN_BUDGET, describe the columns most relevant to `question` in full
+    and summarise the rest (see compact_data_profile).
+    """
+    row_count = profile.get('row_count')
+    lines = [f"Rows: {row_count if row_count is not None else 'unknown'}",
+             "Columns (name | dtype | nulls | distinct values | range):"]
+    lines.extend(_describe_column(column) for column in profile.get('columns', []))
+    if profile.get('sample_rows'):
+        lines.extend(_describe_sample_rows(profile, [column['name'] for column in profile.get('columns', [])]))
+    description = "\n".join(lines)
+
+    if SCHEMA_TOKEN_BUDGET <= 0 or _estimate_tokens(description) <= SCHEMA_TOKEN_BUDGET:
+        return description
+    try:
+        return compact_data_profile(profile, question or '', SCHEMA_TOKEN_BUDGET)
+    except Exception as e:
+        print(f"Could not compact the schema, using the full column list: {e}")
+        return description
+
+
+# --- SCHEMA COMPACTION ---
+# Schemas longer than this many tokens (about 4 characters each) are compacted for the prompt,
+# so prompt size stays about the same however wide the table is. 0 always sends every column.
+SCHEMA_TOKEN_BUDGET = int(os.environ.get('SCHEMA_TOKEN_BUDGET', 2000))
+# Columns whose names only differ in their numbers (sales_2021_q1, sales_2021_q2, ...) are
+# summarised as one pattern once there are at least this many of them
+SCHEMA_GROUP_MIN_COLUMNS = 3
+# Words of the question that say nothing about which columns it needs
+QUESTION_STOPWORDS = frozenset("""
+    a an and are as at be by can column columns data dataset df do does each for from give how i in is it
+    me of on or per please show table than that the their them there this to was what when where which
+    who why with you
+""".split())
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _name_tokens(text: str) -> list:
+    """Lowercase words of a column name or question, splitting camelCase and any punctuation."""
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
+    return [token for token in re.split(r'[^0-9a-z]+', text.lower()) if token]
+
+
+def _column_pattern(name: str) -> str:
+    return re.sub(r'\d+', '#', name)
+
+
+def _column_prefix(name: str) -> str:
+    """Name up to its last separator, e.g. 'misc_field_' for 'misc_field_ab12'; '' if it has none."""
+    match = re.match(r'(.*[_\-. ])', name)
+    return match.group(1) if match else ''
+
+
+def group_columns(columns: list) -> list:
+    """
+    Group column indexes, first by name pattern with the numbers masked out (and dtype),
+    then the columns left over by shared prefix. Only groups of at least
+    SCHEMA_GROUP_MIN_COLUMNS columns are returned, as (label, indexes) in dataset order.
+    """
+    by_pattern = {}
+    for index, column in enumerate(columns):
+        by_pattern.setdefault((_column_pattern(column['name']), column['dtype']), []).append(index)
+    groups = [(pattern, indexes) for (pattern, _), indexes in by_pattern.items()
+              if len(indexes) >= SCHEMA_GROUP_MIN_COLUMNS]
+
+    grouped = {index for _, indexes in groups for index in indexes}
+    by_prefix = {}
+    for index, column in enumerate(columns):
+        prefix = _column_prefix(column['name'])
+        if index not in grouped and prefix:
+            by_prefix.setdefault(prefix, []).append(index)
+    groups += [(prefix + '*', indexes) for prefix, indexes in by_prefix.items()
+               if len(indexes) >= SCHEMA_GROUP_MIN_COLUMNS]
+    return sorted(groups, key=lambda group: group[1][0])
+
+
+def rank_columns(columns: list, question: str) -> list:
+    """
+    Score each column by lexical overlap of its name with the question: a shared word counts
+    by how rare it is among the column names (IDF), a word one is the prefix of (sale/sales)
+    counts half, and a column name quoted whole in the question counts extra.
+    """
+    question_lower = question.lower()
+    question_tokens = set(_name_tokens(question)) - QUESTION_STOPWORDS
+    column_tokens = [set(_name_tokens(column['name'])) for column in columns]
+    document_frequency = {}
+    for tokens in column_tokens:
+        for token in tokens:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+
+    scores = []
+    for column, tokens in zip(columns, column_tokens):
+        score = 0.0
+        for token in tokens:
+            idf = math.log((1 + len(columns)) / (1 + document_frequency[token])) + 1
+            if token in question_tokens:
+                score += idf
+            elif len(token) >= 3 and any(len(word) >= 3 and (word.startswith(token) or token.startswith(word))
+                                         for word in question_tokens):
+                score += idf / 2
+        if len(column['name']) >= 3 and column['name'].lower() in question_lower:
+            score += 2.0
+        scores.append(score)
+    return scores
+
+
+def compact_data_profile(profile: dict, question: str, token_budget: int) -> str:
+    """
+    Describe a wide table within about `token_budget` tokens: full details for the columns
+    most relevant to the question, one line per group of similarly named columns, sample
+    rows of the detailed columns, then the names of other columns while room is left.
+    """
+    columns = profile.get('columns', [])
+    scores = rank_columns(columns, question)
+    groups = group_columns(columns)
+
+    # Within a group, a column is only relevant if it matches better than its siblings
+    # (sales_2019_q1 for "sales in 2019"); the group line stands for the rest
+    group_floor = {}
+    for _, indexes in groups:
+        floor = min(scores[index] for index in indexes)
+        group_floor.update((index, floor) for index in indexes)
+    relevant = sorted((index for index in range(len(columns)) if scores[index] > group_floor.get(index, 0)),
+                      key=lambda index: (-scores[index], index))
+    # Then ungrouped columns in dataset order
+    relevant_set = set(relevant)
+    candidates = relevant + [index for index in range(len(columns))
+                             if index not in group_floor and index not in relevant_set]
+
+    row_count = profile.get('row_count')
+    header = [f"Rows: {row_count if row_count is not None else 'unknown'}",
+              f"The table has {len(columns)} columns, too many to list. All of them are in the data under "
+              f"their exact names; the ones most relevant to the question are described in full, the rest summarised.",
+              "Columns (name | dtype | nulls | distinct values | range):"]
+    used = _estimate_tokens("\n".join(header))
+
+    # Half the budget for column details, then groups up to 65%, sample rows up to 85%, the rest for other names
+    detailed = []
+    for index in candidates:
+        cost = _estimate_tokens(_describe_column(columns[index]))
+        if used + cost > token_budget * 0.5:
+            break
+        detailed.append(index)
+        used += cost
+    listed = set(detailed)
+
+    group_lines = []
+    for label, indexes in groups:
+        remaining = [index for index in indexes if index not in listed]
+        if not remaining:
+            continue
+        dtypes = {columns[index]['dtype'] for index in remaining}
+        line = (f"- {label} | {dtypes.pop() if len(dtypes) == 1 else 'mixed'} | {len(remaining)} columns | "
+                f"{columns[remaining[0]]['name']} ... {columns[remaining[-1]]['name']}")
+        if used + _estimate_tokens(line) > token_budget * 0.65:
+            break
+        group_lines.append(line)
+        listed.update(remaining)
+        used += _estimate_tokens(line)
+
+    sample_lines = []
+    if profile.get('sample_rows') and detailed:
+        sample_lines = _describe_sample_rows(profile, [columns[index]['name'] for index in sorted(detailed)])
+        sample_cost = _estimate_tokens("\n".join(sample_lines))
+        if used + sample_cost > token_budget * 0.85:
+            sample_lines = []
+        else:
+            used += sample_cost
+
+    other_names = []
+    for index, column in enumerate(columns):
+        if index in listed:
+            continue
+        cost = _estimate_tokens(column['name'] + ", ")
+        if used + cost > token_budget:
+            break
+        other_names.append(column['name'])
+        listed.add(index)
+        used += cost
+    unlisted = len(columns) - len(listed)
+
+    lines = header + [_describe_column(columns[index]) for index in sorted(detailed)]
+    if group_lines:
+        lines.append("Column groups (name pattern, # stands for a number and * for any text | dtype | count | first ... last):")
+        lines.extend(group_lines)
+    if other_names:
+        lines.append("Other columns: " + ", ".join(other_names))
+    if unlisted:
+        lines.append(f"({unlisted} more columns not listed)")
+    lines.extend(sample_lines)
+    print(f"Compacted schema of {len(columns)} columns: {len(detailed)} in full, {len(group_lines)} groups, "
+          f"{len(other_names)} other names, {unlisted} unlisted")
+    return "\n".join(lines)
+
+
+# --- GENERATED CODE CACHE ---
+# Code that ran successfully is reused when the same question is asked about a data source
+# with the same columns, skipping the LLM call. 0 entries disables the cache.
+CODE_CACHE_MAX_ENTRIES = int(os.environ.get('CODE_CACHE_MAX_ENTRIES', 1000))
+CODE_CACHE_TTL_SECONDS = int(os.environ.get('CODE_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+# Also keep entries in the code_cache table so they survive restarts and are shared between workers
+CODE_CACHE_PERSISTENT = os.environ.get('CODE_CACHE_PERSISTENT', 'false').lower() == 'true'
+
+
+class GeneratedCodeCache:
+    """In-process LRU cache of generated code with a time-to-live, keyed by code_cache_key()."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # cache_key -> (generated_code, cached_at)
+        self._lock = threading.Lock()
+
+    def get(self, cache_key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            if time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry[0]
+
+    def put(self, cache_key: str, generated_code: str, cached_at: Optional[float] = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[cache_key] = (generated_code, cached_at or time.time())
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, cache_key: str):
+        with self._lock:
+            self._entries.pop(cache_key, None)
+
+
+code_cache = GeneratedCodeCache(CODE_CACHE_MAX_ENTRIES, CODE_CACHE_TTL_SECONDS)
+
+
+def code_cache_key(question: str, profile: dict, model_type: str, out_of_core: bool) -> str:
+    """
+    Hash the question (case, whitespace and trailing punctuation ignored), the column
+    names and dtypes of the data source, the model and the execution mode.
+    """
+    normalized_question = re.sub(r'\s+', ' ', question.strip().lower()).rstrip(' ?.!')
+    schema = [(column['name'], column['dtype']) for column in profile.get('columns', [])]
+    key_material = json.dumps([normalized_question, schema, model_type, out_of_core], default=str)
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+
+def get_cached_code(cache_key: str) -> Optional[str]:
+    """Look the key up in this worker's cache, then in the code_cache table if enabled."""
+    generated_code = code_cache.get(cache_key)
+    if generated_code is not None or not CODE_CACHE_PERSISTENT or CODE_CACHE_MAX_ENTRIES <= 0:
+        return generated_code
+    try:
+        cached = db.session.get(CachedCode, cache_key)
+        if cached is None:
+            return None
+        if time.time() - cached.cached_at > CODE_CACHE_TTL_SECONDS:
+            db.session.delete(cached)
+            db.session.commit()
+            return None
+        code_cache.put(cache_key, cached.generated_code, cached.cached_at)
+        return cached.generated_code
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not read the code cache table: {e}")
+        return None
+
+
+def store_generated_code(cache_key: str, generated_code: str):
+    """Remember code that ran successfully. The table write also drops expired rows."""
+    if CODE_CACHE_MAX_ENTRIES <= 0:
+        return
+    code_cache.put(cache_key, generated_code)
+    if not CODE_CACHE_PERSISTENT:
+        return
+    try:
+        now = time.time()
+        CachedCode.query.filter(CachedCode.cached_at < now - CODE_CACHE_TTL_SECONDS).delete()
+        db.session.merge(CachedCode(cache_key=cache_key, generated_code=generated_code, cached_at=now))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not write the code cache table: {e}")
+
+
+def discard_cached_code(cache_key: str):
+    """Forget cached code that failed when it was reused."""
+    code_cache.invalidate(cache_key)
+    if not CODE_CACHE_PERSISTENT:
+        return
+    try:
+        CachedCode.query.filter_by(cache_key=cache_key).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not update the code cache table: {e}")
+
+
+# --- RESULT CACHE ---
+# Printed output and generated files of analyses that completed, reused when the same code runs
+# against the same version of a data source. Files are copied server-side in R2. 0 disables the cache.
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 24 * 3600))
+
+
+def result_cache_key(dataset_etag: str, generated_code: str) -> str:
+    return hashlib.sha256(f"{dataset_etag}\n{generated_code}".encode('utf-8')).hexdigest()
+
+
+def get_cached_result(cache_key: str) -> Optional[dict]:
+    """Return {"printed_output", "artifacts"} recorded for this key, or None."""
+    if RESULT_CACHE_TTL_SECONDS <= 0:
+        return None
+    try:
+        cached = db.session.get(CachedResult, cache_key)
+        if cached is None:
+            return None
+        if time.time() - cached.cached_at > RESULT_CACHE_TTL_SECONDS:
+            db.session.delete(cached)
+            db.session.commit()
+            return None
+        return {"printed_output": cached.printed_output, "artifacts": json.loads(cached.artifacts)}
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not read the result cache: {e}")
+        return None
+
+
+def store_result(cache_key: str, printed_output: str, artifacts: list[dict]):
+    """Record the outcome of an analysis. The write also drops expired rows."""
+    if RESULT_CACHE_TTL_SECONDS <= 0:
+        return
+    try:
+        now = time.time()
+        CachedResult.query.filter(CachedResult.cached_at < now - RESULT_CACHE_TTL_SECONDS).delete()
+        db.session.merge(CachedResult(cache_key=cache_key, printed_output=printed_output,
+                                      artifacts=json.dumps(artifacts), cached_at=now))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not write the result cache: {e}")
+
+
+def discard_cached_result(cache_key: str):
+    """Forget a result whose files can no longer be copied (e.g. the originals were deleted)."""
+    try:
+        CachedResult.query.filter_by(cache_key=cache_key).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Could not update the result cache: {e}")
+
+
 with app.app_context():
     # Check if table exists
     db.create_all()
     inspector = db.inspect(db.engine)
     tables = inspector.get_table_names()
 
-def generate_file_intro_message(user_message, file_type, file_content_summary=None, model_type='standard'):
+def _fallback_intro_message(user_message, file_type):
+    """Intro used when the model's message for a file is missing, empty or too long."""
+    if file_type == 'png':
+        return f"I've created a visualization based on your request about {user_message[:50]}{'...' if len(user_message) > 50 else ''}."
+    elif file_type == 'csv':
+        return f"Here's the data analysis you requested, exported as a downloadable file."
+    else:
+        return "I've generated a file based on your request."
+
+
+def _error_intro_message(file_type):
+    """Intro used when the intro request itself failed."""
+    if file_type == 'png':
+        return "I've created a visualization based on your data analysis request."
+    elif file_type == 'csv':
+        return "Here are the results of your data analysis, ready for download."
+    else:
+        return "I've generated a file based on your request."
+
+
+def generate_file_intro_messages(user_message, files, model_type='standard'):
     """
-    Generate an introductory message for a generated file using Gemini API
+    Generate introductory messages for all files of a chat turn with a single Gemini call.
+    `files` is a list of (file_type, file_content_summary or None); returns one message per file.
     """
-    try:
-        # Get API key from your api_key_manager
-        api_key = api_key_manager.get_current_key()
-        if not api_key:
-            return "I've generated a file based on your request."
-        
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        
-        # Choose model based on model_type
-        if model_type == 'premium':
-            model = genai.GenerativeModel('gemini-1.5-pro')
-        else:
-            model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Create context-aware prompt
-        if file_type == 'png':
-            file_description = "visualization/chart/graph"
-        elif file_type == 'csv':
-            file_description = "data analysis results in CSV format"
-        else:
-            file_description = "file"
-        
-        prompt = f"""
-        Generate a brief, friendly introductory message (1-2 sentences) for a {file_description} that was created based on this user request: "{user_message}"
-        
-        The message should:
+    if not files:
+        return []
+
+    file_descriptions = {
+        'png': "A visualization/chart/graph",
+        'csv': "Data analysis results in CSV format"
+    }
+    file_lines = []
+    for index, (file_type, file_content_summary) in enumerate(files, start=1):
+        line = f"{index}. {file_descriptions.get(file_type, 'A file')}"
+        if file_content_summary:
+            line += f". Additional context about the file content: {file_content_summary}"
+        file_lines.append(line)
+    file_list = "\n        ".join(file_lines)
+
+    prompt = f"""
+        Generate a brief, friendly introductory message (1-2 sentences) for each of the following {len(files)} files, which were created based on this user request: "{user_message}"
+
+        {file_list}
+
+        Each message should:
         - Be conversational and helpful
         - Explain what the file contains or shows
         - Not mention technical details about file formats
         - Be under 100 words
         - Start naturally (avoid "Here is..." or "I have created...")
-        
+
         Example styles:
         - "This visualization shows the sales trends across different regions for the past quarter."
         - "The analysis reveals interesting patterns in customer behavior throughout the year."
         - "Based on your data, I've identified the top performing products and their monthly sales figures."
+
+        Respond with a JSON array of exactly {len(files)} strings, one message per file, in the order listed above.
         """
-        
-        if file_content_summary:
-            prompt += f"\n\nAdditional context about the file content: {file_content_summary}"
-        
-        response = model.generate_content(prompt)
-        intro_message = response.text.strip()
-        
-        # Fallback if response is too long or empty
-        if not intro_message or len(intro_message) > 200:
-            if file_type == 'png':
-                return f"I've created a visualization based on your request about {user_message[:50]}{'...' if len(user_message) > 50 else ''}."
-            elif file_type == 'csv':
-                return f"Here's the data analysis you requested, exported as a downloadable file."
-            else:
-                return "I've generated a file based on your request."
-        
-        return intro_message
-        
-    except Exception as e:
-        print(f"Error generating intro message: {e}")
-        # Fallback messages
-        if file_type == 'png':
-            return "I've created a visualization based on your data analysis request."
-        elif file_type == 'csv':
-            return "Here are the results of your data analysis, ready for download."
+
+    response_text, error = call_gemini_with_retry(prompt, model_type, generation_config={"response_mime_type": "application/json"},
+                                                purpose='intro')
+    if error:
+        print(f"Error generating intro messages: {error}")
+        return [_error_intro_message(file_type) for file_type, _ in files]
+
+    try:
+        intro_messages = json.loads(response_text.strip().replace('```json', '').replace('```', '').strip())
+        if not isinstance(intro_messages, list):
+            raise ValueError("response is not a list")
+    except ValueError as e:
+        print(f"Could not parse intro messages: {e}")
+        intro_messages = []
+    if len(intro_messages) != len(files):
+        print(f"Expected {len(files)} intro messages, got {len(intro_messages)}")
+
+    results = []
+    for index, (file_type, _) in enumerate(files):
+        intro_message = intro_messages[index] if index < len(intro_messages) else None
+        # Fallback if a message is missing, too long or empty
+        if not isinstance(intro_message, str) or not intro_message.strip() or len(intro_message.strip()) > 200:
+            results.append(_fallback_intro_message(user_message, file_type))
         else:
-            return "I've generated a file based on your request."
+            results.append(intro_message.strip())
+    return results
+
+
+# --- LLM METRICS ---
+# Upper bounds (seconds) of the latency histogram buckets; a last bucket catches everything slower
+LLM_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60)
+
+
+class LLMMetrics:
+    """
+    In-memory counters for Gemini calls since the process started: a latency histogram,
+    attempts and token counts per (model, purpose), and usage and errors per API key.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._calls = {}  # (model_name, purpose) -> stats
+        self._keys = {}  # last 4 characters of the key -> stats
+        self._lock = threading.Lock()
+
+    def _call_stats(self, model_name: str, purpose: str) -> dict:
+        return self._calls.setdefault((model_name, purpose), {
+            "calls": 0, "succeeded": 0, "failed": 0, "attempts": 0, "retries": 0, "rotations": 0, "hedges": 0,
+            "prompt_tokens": 0, "response_tokens": 0,
+            "latency_seconds": {"count": 0, "sum": 0.0, "buckets": [0] * (len(LLM_LATENCY_BUCKETS) + 1)}
+        })
+
+    def _key_stats(self, api_key: str) -> dict:
+        return self._keys.setdefault(f"...{api_key[-4:]}", {
+            "requests": 0, "prompt_tokens": 0, "response_tokens": 0, "latency_seconds_sum": 0.0,
+            "errors": {}
+        })
+
+    def record_attempt(self, api_key: str, model_name: str, purpose: str, outcome: str, seconds: float,
+                       prompt_tokens: int = 0, response_tokens: int = 0):
+        """One request sent on one key; `outcome` is 'ok' or the kind of error it failed with."""
+        with self._lock:
+            stats = self._call_stats(model_name, purpose)
+            stats["attempts"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["response_tokens"] += response_tokens
+            key_stats = self._key_stats(api_key)
+            key_stats["requests"] += 1
+            key_stats["prompt_tokens"] += prompt_tokens
+            key_stats["response_tokens"] += response_tokens
+            key_stats["latency_seconds_sum"] += seconds
+            if outcome != 'ok':
+                key_stats["errors"][outcome] = key_stats["errors"].get(outcome, 0) + 1
+
+    def record_hedge(self, model_name: str, purpose: str):
+        with self._lock:
+            self._call_stats(model_name, purpose)["hedges"] += 1
+
+    def record_call(self, model_name: str, purpose: str, succeeded: bool, seconds: float, retries: int, rotations: int):
+        """One call_gemini_with_retry call, end to end including retries and backoff."""
+        with self._lock:
+            stats = self._call_stats(model_name, purpose)
+            stats["calls"] += 1
+            stats["succeeded" if succeeded else "failed"] += 1
+            stats["retries"] += retries
+            stats["rotations"] += rotations
+            latency = stats["latency_seconds"]
+            latency["count"] += 1
+            latency["sum"] += seconds
+            latency["buckets"][bisect.bisect_left(LLM_LATENCY_BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = []
+            for (model_name, purpose), stats in sorted(self._calls.items()):
+                latency = stats["latency_seconds"]
+                bounds = [str(bound) for bound in LLM_LATENCY_BUCKETS] + ["+Inf"]
+                calls.append({
+                    "model": model_name,
+                    "purpose": purpose,
+                    **{name: value for name, value in stats.items() if name != "latency_seconds"},
+                    "latency_seconds": {
+                        "count": latency["count"],
+                        "sum": round(latency["sum"], 3),
+                        # Cumulative counts of calls at most this slow
+                        "buckets": [{"le": bound, "count": count}
+                                    for bound, count in zip(bounds, itertools.accumulate(latency["buckets"]))]
+                    }
+                })
+            keys = {key: {**stats, "errors": dict(stats["errors"]), "latency_seconds_sum": round(stats["latency_seconds_sum"], 3)}
+                    for key, stats in self._keys.items()}
+        return {"uptime_seconds": round(time.time() - self.started_at), "calls": calls, "keys": keys}
+
 
+llm_metrics = LLMMetrics()
 
-def call_gemini_with_retry(prompt: str, model_type: str = 'standard', max_retries: int = 3) -> tuple[Optional[str], Optional[str]]:
-    """Call Gemini API with automatic key rotation and model selection."""
+
+# --- GEMINI CALLS ---
+# Exponential backoff with full jitter between retries of transient errors
+GEMINI_BACKOFF_BASE_SECONDS = float(os.environ.get('GEMINI_BACKOFF_BASE_SECONDS', 1))
+GEMINI_BACKOFF_MAX_SECONDS = float(os.environ.get('GEMINI_BACKOFF_MAX_SECONDS', 30))
+# Hedged requests: if a call is slower than the model's recent p95 latency, send a duplicate on
+# another key and take whichever answers first. Costs extra quota for the slowest ~5% of calls.
+GEMINI_HEDGE_REQUESTS = os.environ.get('GEMINI_HEDGE_REQUESTS', 'false').lower() == 'true'
+GEMINI_HEDGE_MIN_SAMPLES = int(os.environ.get('GEMINI_HEDGE_MIN_SAMPLES', 20))
+GEMINI_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get('GEMINI_HEDGE_MIN_DELAY_SECONDS', 2))
+
+# Errors worth another attempt; anything else (bad request, blocked prompt, ...) fails immediately
+RATE_LIMIT_ERRORS = (google_exceptions.TooManyRequests,)  # Includes ResourceExhausted
+KEY_ERRORS = (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied)
+TRANSIENT_ERRORS = (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded,
+                    google_exceptions.InternalServerError, google_exceptions.BadGateway,
+                    google_exceptions.GatewayTimeout, google_exceptions.Aborted,
+                    ConnectionError, TimeoutError)
+
+
+class LatencyTracker:
+    """Recent successful call latencies per model, for the hedging deadline."""
+
+    def __init__(self, window: int = 200):
+        self._samples = {}  # model_name -> deque of seconds
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, model_name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model_name, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, model_name: str, fraction: float) -> Optional[float]:
+        """None until GEMINI_HEDGE_MIN_SAMPLES calls have been seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(model_name, ()))
+        if len(samples) < GEMINI_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+gemini_latency = LatencyTracker()
+# Threads for hedged calls; only used when GEMINI_HEDGE_REQUESTS is on. A call is only hedged
+# while the pool has a thread for it and one for its hedge; otherwise it runs on its caller's thread
+GEMINI_HEDGE_THREADS = int(os.environ.get('GEMINI_HEDGE_THREADS', 16))
+gemini_hedge_executor = ThreadPoolExecutor(max_workers=GEMINI_HEDGE_THREADS, thread_name_prefix='gemini-hedge')
+# Pool threads reserved by hedged calls in progress, never more than GEMINI_HEDGE_THREADS so nothing queues
+_hedge_threads_reserved = 0
+_hedge_threads_lock = threading.Lock()
+
+
+def _reserve_hedge_threads(count: int) -> bool:
+    global _hedge_threads_reserved
+    with _hedge_threads_lock:
+        if _hedge_threads_reserved + count > GEMINI_HEDGE_THREADS:
+            return False
+        _hedge_threads_reserved += count
+        return True
+
+
+def _release_hedge_thread():
+    global _hedge_threads_reserved
+    with _hedge_threads_lock:
+        _hedge_threads_reserved -= 1
+
+
+def _submit_hedge_pool_call(fn, *args):
+    """Run `fn(*args)` on a pool thread reserved with _reserve_hedge_threads, freeing it when done."""
+    def run():
+        try:
+            return fn(*args)
+        finally:
+            _release_hedge_thread()
+    return gemini_hedge_executor.submit(run)
+
+
+def _server_retry_delay(error: Exception) -> Optional[float]:
+    """Retry delay the server asked for, from a RetryInfo error detail or the error message."""
+    for detail in getattr(error, 'details', None) or []:
+        if isinstance(detail, error_details_pb2.RetryInfo):
+            return detail.retry_delay.seconds + detail.retry_delay.nanos / 1e9
+    match = re.search(r'retry in ([\d.]+)s|retry_delay\s*\{\s*seconds:\s*(\d+)', str(error), re.IGNORECASE)
+    if match:
+        return float(match.group(1) or match.group(2))
+    return None
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(GEMINI_BACKOFF_MAX_SECONDS, GEMINI_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _call_model(api_key: str, model_name: str, prompt: str, generation_config: Optional[dict],
+                estimated_tokens: int, purpose: str):
+    """
+    One generate_content call on a key already acquired from api_key_manager, which is released
+    here. Rate-limit and key errors put the key on cooldown before they are re-raised.
+    """
+    tokens_used = None
+    started = time.monotonic()
+    try:
+        # Reuse this key's client for the selected model
+        model = gemini_models.get_model(api_key, model_name)
+        response = model.generate_content(prompt, generation_config=generation_config)
+        text = response.text
+        elapsed = time.monotonic() - started
+        gemini_latency.record(model_name, elapsed)
+        usage = getattr(response, 'usage_metadata', None)
+        tokens_used = usage.total_token_count if usage else None
+        llm_metrics.record_attempt(api_key, model_name, purpose, 'ok', elapsed,
+                                   usage.prompt_token_count if usage else 0,
+                                   usage.candidates_token_count if usage else 0)
+        return text, api_key
+    except RATE_LIMIT_ERRORS as e:
+        llm_metrics.record_attempt(api_key, model_name, purpose, 'rate_limited', time.monotonic() - started)
+        api_key_manager.report_rate_limited(api_key, _server_retry_delay(e))
+        raise
+    except KEY_ERRORS:
+        llm_metrics.record_attempt(api_key, model_name, purpose, 'rejected', time.monotonic() - started)
+        api_key_manager.cool_down(api_key, GEMINI_KEY_COOLDOWN_SECONDS * 10, "was rejected")
+        raise
+    except TRANSIENT_ERRORS:
+        llm_metrics.record_attempt(api_key, model_name, purpose, 'transient', time.monotonic() - started)
+        raise
+    except Exception:
+        llm_metrics.record_attempt(api_key, model_name, purpose, 'error', time.monotonic() - started)
+        raise
+    finally:
+        api_key_manager.release(api_key, estimated_tokens, tokens_used)
+
+
+def _call_model_hedged(model_name: str, prompt: str, generation_config: Optional[dict], estimated_tokens: int,
+                       purpose: str, keys_tried: list):
+    """
+    Call the model; if it hasn't answered by the model's p95 latency, send the same request on
+    another key and return whichever succeeds first. The slower call finishes in the background.
+    When the hedge pool has no room for both calls, this is a plain call on the caller's thread.
+    The key of the first request is appended to `keys_tried`.
+    """
+    first_key = api_key_manager.acquire(estimated_tokens)
+    keys_tried.append(first_key)
+    p95 = gemini_latency.percentile(model_name, 0.95)
+    if not GEMINI_HEDGE_REQUESTS or p95 is None or not _reserve_hedge_threads(2):
+        return _call_model(first_key, model_name, prompt, generation_config, estimated_tokens, purpose)
+
+    pending = {_submit_hedge_pool_call(_call_model, first_key, model_name, prompt, generation_config, estimated_tokens, purpose)}
+    hedge_after = max(p95, GEMINI_HEDGE_MIN_DELAY_SECONDS)
+    done, _ = wait(pending, timeout=hedge_after)
+    hedge_key = None if done else api_key_manager.try_acquire(estimated_tokens, exclude=first_key)
+    if hedge_key:
+        print(f"No answer after {hedge_after:.1f}s (p95 {p95:.1f}s), hedging on API key ending in ...{hedge_key[-4:]}")
+        llm_metrics.record_hedge(model_name, purpose)
+        pending.add(_submit_hedge_pool_call(_call_model, hedge_key, model_name, prompt, generation_config, estimated_tokens, purpose))
+    else:
+        _release_hedge_thread()
+
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def call_gemini_with_retry(prompt: str, model_type: str = 'standard', max_retries: int = 3,
+                           generation_config: Optional[dict] = None, purpose: str = 'other') -> tuple[Optional[str], Optional[str]]:
+    """
+    Call Gemini API with quota-aware key selection, backoff between retries and optional hedging.
+    `purpose` ('code', 'intro', 'interpretation', ...) labels the call in llm_metrics.
+    """
     
     # Map frontend model selection to the official Google model names
     model_map = {
@@ -192,50 +1373,78 @@ def call_gemini_with_retry(prompt: str, model_type: str = 'standard', max_retrie
     
     print(f"Attempting to use model: {model_name}")
 
+    started = time.monotonic()
+    keys_tried = []
+    response_text, error = _retry_gemini_call(model_name, prompt, generation_config, max_retries, purpose, keys_tried)
+    rotations = sum(1 for previous, key in zip(keys_tried, keys_tried[1:]) if key != previous)
+    llm_metrics.record_call(model_name, purpose, error is None, time.monotonic() - started,
+                            max(0, len(keys_tried) - 1), rotations)
+    return response_text, error
+
+
+def _retry_gemini_call(model_name: str, prompt: str, generation_config: Optional[dict], max_retries: int,
+                       purpose: str, keys_tried: list) -> tuple[Optional[str], Optional[str]]:
+    # Rough size of the prompt for the tokens-per-minute buckets, about 4 characters per token
+    estimated_tokens = len(prompt) // 4 + 1
+
     for attempt in range(max_retries):
         try:
-            # Configure with current API key
-            current_key = api_key_manager.get_current_key()
-            genai.configure(api_key=current_key)
-            
-            # Use the dynamically selected model name
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt)
-            
-            print(f"Successfully used API key ending in ...{current_key[-4:]} with model {model_name} (attempt {attempt + 1})")
-            return response.text, None
-            
-        except Exception as e:
-            error_str = str(e).lower()
+            response_text, api_key = _call_model_hedged(model_name, prompt, generation_config, estimated_tokens,
+                                                        purpose, keys_tried)
+            print(f"Successfully used API key ending in ...{api_key[-4:]} with model {model_name} (attempt {attempt + 1})")
+            return response_text, None
+
+        except RATE_LIMIT_ERRORS as e:
+            # The key is cooling down; the next attempt goes to another key, or waits for quota
             print(f"Attempt {attempt + 1} failed with error: {e}")
-            
-            # Check if it's a rate limit or quota error
-            if any(keyword in error_str for keyword in [
-                'quota', 'rate limit', 'too many requests', 'resource_exhausted', 
-                'rate_limit_exceeded', '429', 'quota exceeded'
-            ]):
-                if api_key_manager.get_available_keys_count() > 1:
-                    print("Rate limit detected, rotating API key...")
-                    api_key_manager.rotate_key()
-                    time.sleep(1)  # Brief pause before retry
-                    continue
-                else:
-                    print("All API keys are rate limited")
-            
-            # For other errors, still try rotating if we have more attempts
-            if attempt < max_retries - 1 and api_key_manager.get_available_keys_count() > 1:
-                print("Non-rate-limit error, trying different API key...")
-                api_key_manager.rotate_key()
-                time.sleep(1)
+            if attempt < max_retries - 1:
                 continue
-            
-            # If this is the last attempt or no more keys available
-            return None, f"Failed after {max_retries} attempts. Last error: {e}"
-    
+            return None, f"Failed after {attempt + 1} attempts. Last error: {e}"
+
+        except KEY_ERRORS as e:
+            # The key itself was refused; only another key can help
+            print(f"Attempt {attempt + 1} failed with error: {e}")
+            if attempt < max_retries - 1 and api_key_manager.get_available_keys_count() > 0:
+                continue
+            return None, f"Failed after {attempt + 1} attempts. Last error: {e}"
+
+        except TRANSIENT_ERRORS as e:
+            print(f"Attempt {attempt + 1} failed with error: {e}")
+            if attempt < max_retries - 1:
+                delay = _server_retry_delay(e) or _backoff_delay(attempt)
+                print(f"Transient error, retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+            return None, f"Failed after {attempt + 1} attempts. Last error: {e}"
+
+        except APIKeysCoolingDown as e:
+            # No request was sent; wait for the first key to come back instead of failing the call
+            print(f"Attempt {attempt + 1} failed with error: {e}")
+            if attempt < max_retries - 1:
+                delay = min(e.retry_after, GEMINI_BACKOFF_MAX_SECONDS)
+                print(f"Waiting {delay:.1f}s for an API key to cool down...")
+                time.sleep(delay)
+                continue
+            return None, f"Failed after {attempt + 1} attempts. Last error: {e}"
+
+        except Exception as e:
+            print(f"Attempt {attempt + 1} failed with a non-retryable error: {e}")
+            return None, f"Failed after {attempt + 1} attempts. Last error: {e}"
+
     return None, f"All attempts failed"
 
 
-def generate_python_code(question, csv_headers, model = 'standard'):
+def generate_python_code(question, schema_description, model = 'standard', out_of_core = False):
+    if out_of_core:
+        data_environment = f"""- The dataset is too large to load at once, so there is NO `df`. Instead, `read_chunks()` returns an iterator over the rows as pandas DataFrames of at most {OUT_OF_CORE_CHUNK_ROWS} rows each. Every call starts again from the first row.
+        - Process the data chunk by chunk, keeping only small running aggregates (sums, counts, value_counts, groupby results) between chunks, and combine them after the loop (e.g. add up partial groupby sums and counts, then divide for means).
+        - NEVER collect all chunks into one DataFrame (no `pd.concat` of every chunk, no `list(read_chunks())`).
+        - Tables for the user MUST be assigned to `result_df`; other DataFrames are not returned."""
+        data_loading_rule = "Do NOT read the file yourself. Use `read_chunks()`."
+    else:
+        data_environment = "- The CSV data is pre-loaded into a pandas DataFrame called `df`."
+        data_loading_rule = "Do NOT include the `df = pd.read_csv(...)` line. The DataFrame `df` is already loaded."
+
     prompt = f"""
         You are an expert Python data analyst. Your task is to write a Python script to answer a user's question about a given CSV file.
 
@@ -243,7 +1452,7 @@ def generate_python_code(question, csv_headers, model = 'standard'):
         The script will be executed in an environment where:
         - pandas is imported as `pd`
         - matplotlib.pyplot is imported as `plt`
-        - The CSV data is pre-loaded into a pandas DataFrame called `df`.
+        {data_environment}
 
         Your script MUST do one of the following:
         1.  If the user asks for a graph or plot, generate a plot using matplotlib. Do not call `plt.show()`.
@@ -252,12 +1461,13 @@ def generate_python_code(question, csv_headers, model = 'standard'):
 
         **IMPORTANT RULES:**
         - Your output MUST be a single, executable Python code block.
-        - Do NOT include the `df = pd.read_csv(...)` line. The DataFrame `df` is already loaded.
+        - {data_loading_rule}
+        - Use the exact column names from the schema below. Its dtypes show which columns need conversion (e.g. `pd.to_datetime`) before use.
         - Do NOT include any explanations, comments, or markdown formatting like ```python.
         - For plots, make them visually appealing: add titles, labels, and use `plt.tight_layout()`.
 
-        ### CSV File Headers:
-        {csv_headers}
+        ### Dataset Schema:
+        {schema_description}
 
         ### User Question:
         "{question}"
@@ -265,7 +1475,7 @@ def generate_python_code(question, csv_headers, model = 'standard'):
         ### Python Code:
         """
     
-    response_text, error = call_gemini_with_retry(prompt, model)
+    response_text, error = call_gemini_with_retry(prompt, model, purpose='code')
     if error:
         print(f"Error calling Gemini API for code generation: {error}")
         return None, error
@@ -285,7 +1495,7 @@ def interpret_data_for_user(question, data,  model = 'standard'):
     else:
         prompt = f"""You are a helpful assistant. The user asked: "{question}". Based ONLY on the following data, write a clear and friendly answer in English. If presenting a list, use bullet points. Data: {json.dumps(data, indent=2)}"""
 
-    response_text, error = call_gemini_with_retry(prompt, model)
+    response_text, error = call_gemini_with_retry(prompt, model, purpose='interpretation')
     if error:
         print(f"Error calling Gemini API for interpretation: {error}")
         return "Sorry, I encountered an issue while formulating the answer."
@@ -293,160 +1503,447 @@ def interpret_data_for_user(question, data,  model = 'standard'):
     return response_text
 
 
-def with_main_app_context(func):
-    def wrapper(*args, **kwargs):
-        with app.app_context():
-            return func(*args, **kwargs)
-    return wrapper
+# --- CHAT TURN PIPELINE ---
+def _upload_plot(png_bytes, unique_filename):
+    s3_client.upload_fileobj(io.BytesIO(png_bytes), R2_BUCKET_NAME, unique_filename, ExtraArgs={'ContentType': 'image/png'})
 
-@app.route('/api/chatbot/ask', methods=['POST'])
-@with_main_app_context
-def chat_endpoint():
 
-    # --- Helper function to process and upload a single plot ---
-    def _process_plot(fig_num, session_id, user_prompt, model_type):
-        try:
-            plt.figure(fig_num) # Switch to the correct figure
-            
-            # Create DB records
-            new_file = GeneratedFile(chat_session_id=session_id, original_prompt=user_prompt, file_type='png', storage_path='', intro_message='')
-            db.session.add(new_file)
-            db.session.flush() # Get the ID
+def _upload_csv(dataframe, unique_filename):
+    csv_buffer = io.StringIO()
+    dataframe.to_csv(csv_buffer, index=False)
+    s3_client.put_object(Bucket=R2_BUCKET_NAME, Key=unique_filename, Body=csv_buffer.getvalue(), ContentType='text/csv')
 
-            file_message = ChatMessage(session_id=session_id, message_type='bot', message_content=f"{new_file.id}", is_file_info=True)
-            db.session.add(file_message)
 
-            # Upload to Cloudflare
-            unique_filename = f"generated/{new_file.id}_{uuid.uuid4().hex}.png"
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', bbox_inches='tight')
-            buf.seek(0)
-            s3_client.upload_fileobj(buf, R2_BUCKET_NAME, unique_filename, ExtraArgs={'ContentType': 'image/png'})
-            
-            # Generate intro and update record
-            chart_intro = generate_file_intro_message(user_message, 'png', None, model_type)
-            new_file.storage_path = unique_filename
-            new_file.intro_message = chart_intro
-            
-            return {"file_id": new_file.id, "name": unique_filename.split('/')[-1], "intro_message": chart_intro, "file_type": "png"}
-        except Exception as e:
-            print(f"Error processing plot {fig_num}: {e}")
-            db.session.rollback() # Rollback this specific file's transaction
-            return None # Indicate failure
+def _process_artifacts(execution, user_message, session_id, user_prompt, model_type):
+    """
+    Create the file records with a single flush, then upload every file concurrently while one
+    request writes all the intros, so the turn waits for the slowest file rather than all of them in turn.
+    Yields a progress event per finished upload and returns the uploaded files; files that fail
+    to upload are dropped. The caller commits.
+    """
+    artifacts = [('png', png_bytes, None) for png_bytes in execution["figures"]]
+    for df_variable_name, dataframe in execution["dataframes"]:
+        csv_summary = f"File '{df_variable_name}.csv' contains {len(dataframe)} rows with columns: {', '.join(map(str, dataframe.columns))}"
+        artifacts.append(('csv', dataframe, csv_summary))
+    if not artifacts:
+        return []
 
-    # --- Helper function to process and upload a single CSV ---
-    def _process_csv(df_variable_name, dataframe, session_id, user_prompt, model_type):
-        try:
-            # Create DB records
-            new_file = GeneratedFile(chat_session_id=session_id, original_prompt=user_prompt, file_type='csv', storage_path='', intro_message='')
+    new_files = []
+    for file_type, _, _ in artifacts:
+        new_file = GeneratedFile(chat_session_id=session_id, original_prompt=user_prompt, file_type=file_type, storage_path='', intro_message='')
+        db.session.add(new_file)
+        new_files.append(new_file)
+    db.session.flush() # Get all the IDs at once
+
+    # One intro request for all files, running alongside the uploads
+    intros = artifact_executor.submit(generate_file_intro_messages, user_message,
+                                      [(file_type, summary) for file_type, _, summary in artifacts], model_type)
+    uploads = []
+    for new_file, (file_type, content, _) in zip(new_files, artifacts):
+        new_file.storage_path = f"generated/{new_file.id}_{uuid.uuid4().hex}.{file_type}"
+        upload = _upload_plot if file_type == 'png' else _upload_csv
+        uploads.append(artifact_executor.submit(upload, content, new_file.storage_path))
+
+    yield 'status', {"stage": "uploading", "count": len(uploads)}
+    for uploaded, upload in enumerate(as_completed(uploads), start=1):
+        if upload.exception() is None:
+            yield 'status', {"stage": "file_uploaded", "uploaded": uploaded, "count": len(uploads)}
+
+    generated_files = []
+    for new_file, upload, intro in zip(new_files, uploads, intros.result()):
+        if upload.exception() is not None:
+            print(f"Error uploading generated file {new_file.id}: {upload.exception()}")
+            db.session.delete(new_file)
+            continue
+        new_file.intro_message = intro
+        file_message = ChatMessage(session_id=session_id, message_type='bot', message_content=f"{new_file.id}", is_file_info=True)
+        db.session.add(file_message)
+        generated_files.append({"file_id": new_file.id, "name": new_file.storage_path.split('/')[-1],
+                                "intro_message": new_file.intro_message, "file_type": new_file.file_type})
+    return generated_files
+
+
+def _record_text_response(printed_output, generated_files, session_id):
+    """Add the text part of the answer to the session and return it."""
+    if printed_output:
+        text_explanation = printed_output
+    # If no text was printed but files were made, the response can be empty
+    elif generated_files:
+        return ""
+    # If nothing was generated at all, provide a default message
+    else:
+        text_explanation = "I have processed your request. If you expected a file or a specific answer, please try rephrasing."
+    bot_message = ChatMessage(session_id=session_id, message_type='bot', message_content=text_explanation)
+    db.session.add(bot_message)
+    return text_explanation
+
+
+class ChatJobCancelled(Exception):
+    """The queued job of a chat turn was cancelled before the turn could save its answer."""
+
+
+CANCELLED_RESULT = {"status": 409, "body": {"response": "The analysis was cancelled."}}
+
+
+def _commit_turn(response_data: dict, job_id: Optional[int]):
+    """
+    Commit a turn's messages and files. A queued turn's job is marked done in the same transaction,
+    so a cancel either lands first and nothing is saved (ChatJobCancelled), or finds the job finished.
+    """
+    if job_id is not None:
+        finished = ChatJob.query.filter_by(id=job_id, status='running').update(
+            {'status': 'done', 'result': json.dumps({"status": 200, "body": response_data}), 'finished_at': time.time()},
+            synchronize_session=False)
+        if not finished:
+            db.session.rollback()
+            raise ChatJobCancelled(job_id)
+    db.session.commit()
+
+
+def _reuse_cached_result(cached_result, session_id, user_prompt, job_id=None):
+    """Copy the files of a cached result to new files for this session. None if any copy fails."""
+    try:
+        generated_files = []
+        for artifact in cached_result["artifacts"]:
+            new_file = GeneratedFile(chat_session_id=session_id, original_prompt=user_prompt, file_type=artifact['file_type'],
+                                     storage_path='', intro_message=artifact['intro_message'])
             db.session.add(new_file)
             db.session.flush() # Get the ID
 
             file_message = ChatMessage(session_id=session_id, message_type='bot', message_content=f"{new_file.id}", is_file_info=True)
             db.session.add(file_message)
 
-            # Upload to Cloudflare
-            unique_filename = f"generated/{new_file.id}_{uuid.uuid4().hex}.csv"
-            csv_buffer = io.StringIO()
-            dataframe.to_csv(csv_buffer, index=False)
-            s3_client.put_object(Bucket=R2_BUCKET_NAME, Key=unique_filename, Body=csv_buffer.getvalue(), ContentType='text/csv')
-            
-            # Generate intro and update record
-            csv_summary = f"File '{df_variable_name}.csv' contains {len(dataframe)} rows with columns: {', '.join(dataframe.columns)}"
-            csv_intro = generate_file_intro_message(user_message, 'csv', csv_summary, model_type)
+            # Server-side copy, so every file record owns its own object
+            unique_filename = f"generated/{new_file.id}_{uuid.uuid4().hex}.{artifact['file_type']}"
+            s3_client.copy_object(Bucket=R2_BUCKET_NAME, Key=unique_filename,
+                                  CopySource={'Bucket': R2_BUCKET_NAME, 'Key': artifact['storage_path']})
             new_file.storage_path = unique_filename
-            new_file.intro_message = csv_intro
-            
-            return {"file_id": new_file.id, "name": unique_filename.split('/')[-1], "intro_message": csv_intro, "file_type": "csv"}
-        except Exception as e:
-            print(f"Error processing dataframe '{df_variable_name}': {e}")
-            db.session.rollback() # Rollback this specific file's transaction
-            return None # Indicate failure
+            generated_files.append({"file_id": new_file.id, "name": unique_filename.split('/')[-1],
+                                    "intro_message": artifact['intro_message'], "file_type": artifact['file_type']})
 
-    # --- Main function logic starts here ---
-    data = request.get_json()
+        text_explanation = _record_text_response(cached_result["printed_output"], generated_files, session_id)
+        response_data = {"response": text_explanation, "generated_files": generated_files}
+        _commit_turn(response_data, job_id)
+        return response_data
+    except ChatJobCancelled:
+        raise
+    except Exception as e:
+        print(f"Could not reuse cached result: {e}")
+        db.session.rollback()
+        return None
+
+
+def run_chat_turn(data: dict, job_id: Optional[int] = None):
+    """
+    Answer one chat message. Yields ('status', {"stage": ...}) progress events and ends with
+    ('result', {"status": http_status, "body": response_json}). Must run inside an app context.
+    For a queued turn, job_id is its chat job, which is finished along with the saved answer.
+    """
     user_message = data.get('message', '')
     data_source_path = data.get('data_source_path')
+    columnar_path = data.get('columnar_path')
+    data_profile = data.get('data_profile')
     model_type = data.get('model', 'standard')
     session_id = data.get('session_id')
     user_prompt = data.get('user_prompt')
 
     if not all([user_message, data_source_path, s3_client, R2_BUCKET_NAME, session_id]):
-        return jsonify({"error": "Message, data_source_path, session_id, and storage configuration are required"}), 400
+        yield 'result', {"status": 400, "body": {"error": "Message, data_source_path, session_id, and storage configuration are required"}}
+        return
 
     print(f"Received message: '{user_message}' for data source: '{data_source_path}' using model: '{model_type}'")
-    
+    yield 'status', {"stage": "generating_code"}
+
     try:
-        csv_obj = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=data_source_path)
-        df = pd.read_csv(io.BytesIO(csv_obj['Body'].read()))
-        csv_headers = ", ".join(df.columns)
+        dataset_etag, out_of_core = inspect_data_source(data_source_path)
     except Exception as e:
-        return jsonify({"response": f"Error reading data source: {e}"}), 500
+        yield 'result', {"status": 500, "body": {"response": f"Error reading data source: {e}"}}
+        return
 
-    generated_code, error = generate_python_code(user_message, csv_headers, model_type)
-    if error:
-        return jsonify({"response": f"I had trouble understanding that. {error}"}), 500
+    if out_of_core:
+        print(f"Data source '{data_source_path}' exceeds {OUT_OF_CORE_THRESHOLD_BYTES} bytes, using out-of-core mode")
+    if code_executor_pool:
+        # The executor process loads the data itself; this worker only makes sure it is on local disk
+        load_call = (fetch_dataset_reference, data_source_path, columnar_path, out_of_core)
+    elif out_of_core:
+        load_call = (open_chunked_data_source, data_source_path, columnar_path)
+    else:
+        load_call = (load_data_source, data_source_path, columnar_path)
+    df_future = None  # Started once the turn knows it needs the data
+    data_profile_stored = bool(data_profile)
+    if not data_profile:
+        # Data sources uploaded before profiling was added: infer the schema from the first rows
+        try:
+            data_profile = read_data_source_header(data_source_path)
+        except Exception as e:
+            if out_of_core or code_executor_pool:
+                yield 'result', {"status": 500, "body": {"response": f"Error reading data source: {e}"}}
+                return
+            # Code generation waits for the full load instead
+            print(f"Could not read the header of '{data_source_path}', profiling the loaded data instead: {e}")
+            try:
+                df_future = data_loader_executor.submit(*load_call)
+                data_profile = build_data_profile(df_future.result())
+            except Exception as e:
+                yield 'result', {"status": 500, "body": {"response": f"Error reading data source: {e}"}}
+                return
+    # Store a full profile once the DataFrame is here; not out of core or in pool mode, where this
+    # worker never holds the whole frame
+    backfill_profile = not data_profile_stored and not out_of_core and not code_executor_pool
+    schema_description = describe_data_profile(data_profile, user_message)
+
+    cache_key = code_cache_key(user_message, data_profile, model_type, out_of_core)
+    generated_code = get_cached_code(cache_key)
+    used_cached_code = generated_code is not None
+    if used_cached_code:
+        print(f"Reusing cached code for '{user_message}'")
+    else:
+        # Start loading the full data now; code generation runs alongside it and only needs the schema,
+        # so the turn costs max(load, LLM) rather than their sum
+        if df_future is None:
+            df_future = data_loader_executor.submit(*load_call)
+        generated_code, error = generate_python_code(user_message, schema_description, model_type, out_of_core)
+        if error:
+            yield 'result', {"status": 500, "body": {"response": f"I had trouble understanding that. {error}"}}
+            return
+    yield 'status', {"stage": "code_ready", "cached": used_cached_code}
+
+    # The same code against the same version of the data gives the same answer
+    result_key = result_cache_key(dataset_etag, generated_code)
+    cached_result = get_cached_result(result_key)
+    if cached_result:
+        try:
+            cached_response = _reuse_cached_result(cached_result, session_id, user_prompt, job_id)
+        except ChatJobCancelled:
+            yield 'result', CANCELLED_RESULT
+            return
+        if cached_response:
+            print(f"Reusing cached result for '{user_message}'")
+            yield 'result', {"status": 200, "body": cached_response}
+            return
+        discard_cached_result(result_key)
+
+    try:
+        # The whole DataFrame, the chunk reader out of core, or a local file reference for the pool
+        if df_future is None:
+            df_future = data_loader_executor.submit(*load_call)
+        dataset = df_future.result()
+    except Exception as e:
+        yield 'result', {"status": 500, "body": {"response": f"Error reading data source: {e}"}}
+        return
+    if backfill_profile:
+        # Profile a copy taken before the generated code can modify the frame
+        data_loader_executor.submit(store_data_profile, data_source_path, dataset.copy(deep=not SHALLOW_COPY_IS_SAFE))
 
-    captured_output = io.StringIO()
     response_data = {"response": "", "generated_files": []}
 
     try:
-        local_scope = {
-            'pd': pd,
-            'plt': plt,
-            'df': df,
-            'print': lambda *args, **kwargs: print(*args, file=captured_output, **kwargs),
-            'question': user_message
-        }
-        
-        exec(generated_code, {}, local_scope)
+        yield 'status', {"stage": "executing"}
+        if code_executor_pool:
+            execution = code_executor_pool.run(generated_code, dataset, user_message)
+        else:
+            execution = execute_analysis(generated_code, dataset, user_message, out_of_core)
+        if not used_cached_code:
+            store_generated_code(cache_key, generated_code)
 
-        with app.app_context():
-            # Sequentially check for and process any generated plots
-            if 'plt' in local_scope and plt.get_fignums():
-                for fig_num in plt.get_fignums():
-                    plot_data = _process_plot(fig_num, session_id, user_prompt, model_type)
-                    if plot_data:
-                        response_data["generated_files"].append(plot_data)
-                plt.close('all')
-
-            # Sequentially check for and process any generated DataFrames
-            for var_name, var_value in local_scope.items():
-                # Process any new pandas DataFrame created, ignoring the original 'df'
-                if isinstance(var_value, pd.DataFrame) and var_name != 'df':
-                    csv_data = _process_csv(var_name, var_value, session_id, user_prompt, model_type)
-                    if csv_data:
-                        response_data["generated_files"].append(csv_data)
-
-            # Process any text output printed during execution
-            printed_output = captured_output.getvalue().strip()
-            text_explanation = ""
-
-            if printed_output:
-                text_explanation = printed_output
-                bot_message = ChatMessage(session_id=session_id, message_type='bot', message_content=text_explanation)
-                db.session.add(bot_message)
-            # If no text was printed but files were made, the response can be empty
-            elif response_data["generated_files"]:
-                pass 
-            # If nothing was generated at all, provide a default message
-            else:
-                text_explanation = "I have processed your request. If you expected a file or a specific answer, please try rephrasing."
-                bot_message = ChatMessage(session_id=session_id, message_type='bot', message_content=text_explanation)
-                db.session.add(bot_message)
-
-            response_data["response"] = text_explanation
-            
-            # Commit all successful DB changes at the very end
-            db.session.commit()
-            
-            return jsonify(response_data)
+        # Upload any generated plots and DataFrames
+        response_data["generated_files"] = yield from _process_artifacts(execution, user_message, session_id, user_prompt, model_type)
+
+        # Process any text output printed during execution
+        printed_output = execution["printed_output"]
+        response_data["response"] = _record_text_response(printed_output, response_data["generated_files"], session_id)
+
+        # Commit all successful DB changes at the very end
+        _commit_turn(response_data, job_id)
 
+        # Only complete results are reused; a file that failed to upload would be missing
+        if len(response_data["generated_files"]) == len(execution["figures"]) + len(execution["dataframes"]):
+            artifacts = [{"file_type": f["file_type"], "storage_path": f"generated/{f['name']}", "intro_message": f["intro_message"]}
+                         for f in response_data["generated_files"]]
+            store_result(result_key, printed_output, artifacts)
+
+    except ChatJobCancelled:
+        print(f"Chat job {job_id} was cancelled, discarding its answer")
+        yield 'result', CANCELLED_RESULT
+        return
     except Exception as e:
         print(f"!!! EXECUTION ERROR: {e}")
-        plt.close('all')
         db.session.rollback()
-        return jsonify({"response": f"I'm sorry, I encountered an error while analyzing the data: {e}"}), 500
+        if used_cached_code:
+            discard_cached_code(cache_key)
+        yield 'result', {"status": 500, "body": {"response": f"I'm sorry, I encountered an error while analyzing the data: {e}"}}
+        return
+
+    yield 'result', {"status": 200, "body": response_data}
+
+
+# --- CHAT JOB QUEUE ---
+# With CHAT_JOB_QUEUE enabled in the UI, chat turns are rows in chat_jobs, drained by job_worker.py
+CHAT_JOB_POLL_SECONDS = float(os.environ.get('CHAT_JOB_POLL_SECONDS', 1))
+# Running jobs not finished within this time are failed, e.g. because their worker died
+CHAT_JOB_TIMEOUT_SECONDS = float(os.environ.get('CHAT_JOB_TIMEOUT_SECONDS', 900))
+
+
+def claim_chat_job() -> Optional[int]:
+    """Mark the oldest queued job as running and return its id, or None if the queue is empty."""
+    query = ChatJob.query.filter_by(status='queued').order_by(ChatJob.id)
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent workers skip rows another worker is claiming instead of waiting on them
+        chat_job = query.with_for_update(skip_locked=True).first()
+        if chat_job is None:
+            db.session.rollback()
+            return None
+        chat_job.status = 'running'
+        chat_job.claimed_at = time.time()
+        db.session.commit()
+        return chat_job.id
+
+    while True:
+        chat_job = query.first()
+        if chat_job is None:
+            return None
+        claimed = ChatJob.query.filter_by(id=chat_job.id, status='queued').update(
+            {'status': 'running', 'claimed_at': time.time()}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return chat_job.id
+
+
+def fail_stale_chat_jobs():
+    """Fail running jobs that outlived CHAT_JOB_TIMEOUT_SECONDS rather than run them twice."""
+    result = json.dumps({"status": 500, "body": {"response": "I'm sorry, the analysis was interrupted. Please try again."}})
+    failed = ChatJob.query.filter(ChatJob.status == 'running', ChatJob.claimed_at < time.time() - CHAT_JOB_TIMEOUT_SECONDS).update(
+        {'status': 'failed', 'result': result, 'finished_at': time.time()}, synchronize_session=False)
+    db.session.commit()
+    if failed:
+        print(f"Failed {failed} stale chat jobs")
+
+
+def _set_chat_job_progress(job_id: int, progress: dict):
+    """
+    Publish a progress event on its own connection, leaving the turn's transaction alone.
+    Skipped on SQLite, which allows one writer at a time and the turn holds it once it flushes.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        return
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(ChatJob.__table__.update().where(ChatJob.id == job_id).values(progress=json.dumps(progress)))
+    except Exception as e:
+        print(f"Could not update progress of chat job {job_id}: {e}")
+
+
+def run_chat_job(job_id: int):
+    """Run a claimed job's chat turn and store its result. Stops early, saving nothing, if the job is cancelled."""
+    payload = json.loads(db.session.get(ChatJob, job_id).payload)
+    turn = run_chat_turn(payload, job_id)
+    result = None
+    for event, event_payload in turn:
+        if event == 'result':
+            result = event_payload
+            break
+        job_status = db.session.execute(db.select(ChatJob.status).where(ChatJob.id == job_id)).scalar()
+        if job_status != 'running':
+            print(f"Chat job {job_id} was {job_status}, stopping it")
+            turn.close()
+            db.session.rollback()
+            return
+        _set_chat_job_progress(job_id, event_payload)
+    turn.close()
+
+    # A successful turn already finished its job when it saved its answer
+    ChatJob.query.filter_by(id=job_id, status='running').update(
+        {'status': 'done' if result["status"] == 200 else 'failed', 'result': json.dumps(result), 'finished_at': time.time()},
+        synchronize_session=False)
+    db.session.commit()
+
+
+def chat_job_worker_loop(stop_event: threading.Event):
+    """Claim and run jobs until stop_event is set, sleeping CHAT_JOB_POLL_SECONDS while the queue is empty."""
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                fail_stale_chat_jobs()
+                job_id = claim_chat_job()
+                if job_id is not None:
+                    print(f"Running chat job {job_id}")
+                    run_chat_job(job_id)
+                    continue
+        except Exception as e:
+            print(f"Error in chat job worker: {e}")
+        stop_event.wait(CHAT_JOB_POLL_SECONDS)
+
+
+def run_chat_job_workers(worker_count: int):
+    """Drain the chat job queue with worker_count threads until interrupted."""
+    stop_event = threading.Event()
+    workers = [threading.Thread(target=chat_job_worker_loop, args=(stop_event,), name=f'chat-job-{i}', daemon=True)
+               for i in range(worker_count)]
+    for worker in workers:
+        worker.start()
+    print(f"Started {worker_count} chat job workers")
+    try:
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping chat job workers...")
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+def format_sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def with_main_app_context(func):
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return wrapper
+
+# The chat endpoint is only served by this module's own server (`python chatbot_api.py` or
+# `gunicorn chatbot_api:app`); when the web server runs the pipeline in process
+# (CHATBOT_API_MODE='inprocess'), ui.py registers just the metrics endpoint itself
+chatbot_blueprint = Blueprint('chatbot_api', __name__)
+metrics_blueprint = Blueprint('llm_metrics', __name__)
+
+@chatbot_blueprint.route('/api/chatbot/ask', methods=['POST'])
+@with_main_app_context
+def chat_endpoint():
+    """
+    Answer a chat message. Clients that accept text/event-stream get the progress events of
+    run_chat_turn as server-sent events, ending with a 'result' event; others get the final JSON.
+    """
+    data = request.get_json()
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        def event_stream():
+            for event, payload in run_chat_turn(data):
+                yield format_sse(event, payload)
+        return Response(stream_with_context(event_stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    for event, payload in run_chat_turn(data):
+        if event == 'result':
+            return jsonify(payload["body"]), payload["status"]
+
+# Shared secret for monitoring scripts, sent as "Authorization: Bearer <token>". The peer address
+# can't be trusted behind a reverse proxy or ngrok. Unset, the endpoint doesn't exist.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+
+@metrics_blueprint.route('/api/metrics/llm', methods=['GET'])
+def llm_metrics_endpoint():
+    """Gemini call metrics and the current quota of each API key, as JSON."""
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not METRICS_TOKEN or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({**llm_metrics.snapshot(), "key_quota": api_key_manager.snapshot()})
+
+if CHATBOT_API_MODE != 'inprocess':
+    app.register_blueprint(chatbot_blueprint)
+    app.register_blueprint(metrics_blueprint)
 
 if __name__ == '__main__':
     # export GOOGLE_API_KEY="key1,key2,..."
@@ -454,4 +1951,6 @@ if __name__ == '__main__':
     # export R2_ACCESS_KEY_ID="..."
     # export R2_SECRET_ACCESS_KEY="..."
     # export R2_BUCKET_NAME="..."
+    if 'chatbot_api' not in app.blueprints:
+        app.register_blueprint(chatbot_blueprint)
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
@@ -8,14 +8,16 @@ sys.path.insert(0, project_root)
 
 from dotenv import load_dotenv
 load_dotenv()
-from ui import app, cleanup_db_orphans, cleanup_r2_orphans
+from ui import app, cleanup_db_orphans, cleanup_r2_orphans, cleanup_finished_chat_jobs, reconcile_stopped_turns
 
 
 def main():
     """Main function to run the cleanup tasks within the app context."""
     print("Starting periodic cleanup process...")
     with app.app_context():
+        reconcile_stopped_turns()
         cleanup_db_orphans()
+        cleanup_finished_chat_jobs()
         cleanup_r2_orphans()
     print("Cleanup process finished.")
 
@@ -0,0 +1,279 @@
+# Runs AI-generated analysis code, either inside the calling process or in a pool of
+# warm executor processes. Kept free of Flask/database imports so pool processes start fast.
+
+import io
+import os
+import sys
+import time
+import queue
+import pickle
+import select
+import atexit
+import threading
+import subprocess
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow.parquet as pq
+import matplotlib
+matplotlib.use('Agg')  # Use a non-interactive backend for Matplotlib
+import matplotlib.pyplot as plt
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Only the executor pool uses it, and the pool is refused without POSIX
+
+
+# pandas >= 3 is copy-on-write, so a shallow copy already isolates a cached frame
+# from in-place edits made by generated code.
+SHALLOW_COPY_IS_SAFE = int(pd.__version__.split('.')[0]) >= 3
+
+
+# pyplot keeps one global set of figures per process, so generated code run on several threads
+# at once (job worker threads, in-process chat turns) would collect and close each other's charts
+_pyplot_lock = threading.Lock()
+
+
+class CodeExecutionError(Exception):
+    """Generated code failed, timed out or exceeded its memory limit."""
+
+
+############## DATASET READERS ##################################################################################
+
+def read_frame(source, file_format: str) -> pd.DataFrame:
+    """Read a whole CSV/Parquet source. Local files are memory-mapped so processes share the page cache."""
+    is_local_file = isinstance(source, str)
+    if file_format == 'parquet':
+        return pd.read_parquet(source, memory_map=is_local_file)
+    return pd.read_csv(source, memory_map=is_local_file)
+
+
+def chunk_reader(path: str, file_format: str, chunk_rows: int):
+    """
+    Return a `read_chunks()` function over a local file. Each call yields the data
+    from the start as DataFrames of at most `chunk_rows` rows.
+    """
+    if file_format == 'parquet':
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+
+        def read_parquet_chunks():
+            for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+                yield batch.to_pandas()
+        return read_parquet_chunks
+
+    def read_csv_chunks():
+        yield from pd.read_csv(path, chunksize=chunk_rows, memory_map=True)
+    return read_csv_chunks
+
+
+############## EXECUTION ##################################################################################
+
+def execute_analysis(code: str, dataset, question: str, out_of_core: bool = False) -> dict:
+    """
+    Run generated code against `dataset` (a DataFrame, or a `read_chunks` function out of
+    core) and collect what it produced: printed text, figures rendered to PNG bytes and
+    the DataFrames it created. Exceptions raised by the code propagate to the caller.
+    Runs one at a time per process; use a CodeExecutorPool for parallel analyses.
+    """
+    captured_output = io.StringIO()
+    local_scope = {
+        'pd': pd,
+        'plt': plt,
+        'print': lambda *args, **kwargs: print(*args, file=captured_output, **kwargs),
+        'question': question
+    }
+    if out_of_core:
+        local_scope['read_chunks'] = dataset
+    else:
+        local_scope['df'] = dataset
+
+    with _pyplot_lock:
+        try:
+            exec(code, {}, local_scope)
+
+            figures = []
+            for fig_num in plt.get_fignums():
+                plt.figure(fig_num)  # Switch to the correct figure
+                buf = io.BytesIO()
+                plt.savefig(buf, format='png', bbox_inches='tight')
+                figures.append(buf.getvalue())
+        finally:
+            plt.close('all')
+
+    dataframes = []
+    for var_name, var_value in local_scope.items():
+        # Out of core, only explicit results count; other frames are leftover chunks
+        if out_of_core and not var_name.startswith('result_df'):
+            continue
+        # Keep any new pandas DataFrame created, ignoring the original 'df'
+        if isinstance(var_value, pd.DataFrame) and var_name != 'df':
+            dataframes.append((var_name, var_value))
+
+    return {"printed_output": captured_output.getvalue().strip(), "figures": figures, "dataframes": dataframes}
+
+
+############## EXECUTOR POOL ##################################################################################
+
+class _ExecutorProcess:
+    """One warm executor: a Python process running this module's worker loop over pipes."""
+
+    def __init__(self, memory_limit_bytes: int, frame_cache_entries: int):
+        self.jobs_run = 0
+        self.broken = False  # Set when the process can't take another job and must be replaced
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(memory_limit_bytes), str(frame_cache_entries)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            start_new_session=True  # Own process group, so a kill also takes down anything it spawned
+        )
+
+    def run(self, job: dict, timeout_seconds: float) -> dict:
+        self.jobs_run += 1
+        try:
+            self.process.stdin.write(pickle.dumps(job))
+            self.process.stdin.flush()
+
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout_seconds)
+            if not ready:
+                self.broken = True
+                raise CodeExecutionError(f"The analysis took longer than {timeout_seconds:g} seconds and was stopped.")
+            status, payload = pickle.load(self.process.stdout)
+        except (EOFError, BrokenPipeError):
+            # The process died mid-job, most likely killed for exceeding its memory limit
+            self.broken = True
+            raise CodeExecutionError("The analysis ran out of memory and was stopped.")
+        except CodeExecutionError:
+            raise
+        except Exception as e:
+            # Anything else (a garbled reply, an interrupted read, ...) leaves the pipes out of step
+            self.broken = True
+            raise CodeExecutionError(f"The analysis process failed: {type(e).__name__}: {e}")
+        if status == 'error':
+            raise CodeExecutionError(payload)
+        return payload
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, 9)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+
+
+class CodeExecutorPool:
+    """
+    Pool of pre-started processes that already have pandas and matplotlib imported.
+    Each job gets a wall-clock timeout and a memory limit; a worker that times out,
+    dies or has run `max_jobs_per_worker` jobs is killed and replaced, so no state
+    leaks between jobs. Callers block while all workers are busy. POSIX only: it waits on
+    its pipes with select() and kills workers by process group.
+    """
+
+    def __init__(self, size: int, timeout_seconds: float, memory_limit_bytes: int = 0,
+                 max_jobs_per_worker: int = 100, frame_cache_entries: int = 1):
+        if os.name != 'posix':
+            raise RuntimeError("The code executor pool needs a POSIX system (Linux or macOS); "
+                               "set CODE_EXECUTOR_POOL_SIZE=0 to run generated code in-process")
+        self.timeout_seconds = timeout_seconds
+        self.memory_limit_bytes = memory_limit_bytes
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.frame_cache_entries = frame_cache_entries
+        self._all_workers = set()
+        self._workers_lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+        atexit.register(self.shutdown)
+        print(f"Started code executor pool with {size} processes")
+
+    def _spawn(self) -> _ExecutorProcess:
+        worker = _ExecutorProcess(self.memory_limit_bytes, self.frame_cache_entries)
+        with self._workers_lock:
+            self._all_workers.add(worker)
+        return worker
+
+    def _replace(self, worker: _ExecutorProcess) -> _ExecutorProcess:
+        worker.kill()
+        with self._workers_lock:
+            self._all_workers.discard(worker)
+        return self._spawn()
+
+    def run(self, code: str, dataset: dict, question: str) -> dict:
+        """
+        Run generated code in a pool process. `dataset` describes a local file:
+        {"path": ..., "format": "csv"|"parquet", "out_of_core": bool, "chunk_rows": int}.
+        Returns the same dict as execute_analysis; raises CodeExecutionError on failure.
+        """
+        worker = self._idle.get()
+        try:
+            return worker.run({"code": code, "dataset": dataset, "question": question}, self.timeout_seconds)
+        finally:
+            if worker.broken or worker.jobs_run >= self.max_jobs_per_worker:
+                worker = self._replace(worker)
+            self._idle.put(worker)
+
+    def shutdown(self):
+        with self._workers_lock:
+            workers = list(self._all_workers)
+            self._all_workers.clear()
+        for worker in workers:
+            worker.kill()
+
+
+############## WORKER PROCESS ##################################################################################
+
+def _worker_main(memory_limit_bytes: int, frame_cache_entries: int):
+    """Loop run inside a pool process: read pickled jobs from stdin, write results to stdout."""
+    if memory_limit_bytes > 0 and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit_bytes, memory_limit_bytes))
+
+    # Results go over the original stdout; anything else printed goes to stderr
+    job_input = sys.stdin.buffer
+    result_output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # Recently parsed datasets, keyed by their content-addressed local path
+    frame_cache = OrderedDict()
+
+    def open_dataset(spec):
+        if spec['out_of_core']:
+            return chunk_reader(spec['path'], spec['format'], spec['chunk_rows'])
+        df = frame_cache.get(spec['path'])
+        if df is None:
+            df = read_frame(spec['path'], spec['format'])
+            if frame_cache_entries > 0:
+                frame_cache[spec['path']] = df
+                while len(frame_cache) > frame_cache_entries:
+                    frame_cache.popitem(last=False)
+        else:
+            frame_cache.move_to_end(spec['path'])
+        # Generated code may modify its frame in place, so never hand out the cached one
+        return df.copy(deep=not SHALLOW_COPY_IS_SAFE)
+
+    while True:
+        try:
+            job = pickle.load(job_input)
+        except EOFError:
+            break
+        started = time.time()
+        try:
+            dataset = open_dataset(job['dataset'])
+            result = execute_analysis(job['code'], dataset, job['question'], job['dataset']['out_of_core'])
+            reply = ('ok', result)
+        except MemoryError:
+            frame_cache.clear()
+            reply = ('error', "The analysis ran out of memory.")
+        except Exception as e:
+            reply = ('error', f"{type(e).__name__}: {e}")
+        try:
+            data = pickle.dumps(reply)
+        except Exception as e:
+            data = pickle.dumps(('error', f"The analysis produced results that could not be returned: {e}"))
+        print(f"Executor job finished in {time.time() - started:.2f}s ({reply[0]})")
+        result_output.write(data)
+        result_output.flush()
+
+
+if __name__ == '__main__':
+    _worker_main(int(sys.argv[1]), int(sys.argv[2]))
@@ -0,0 +1,29 @@
+# Run to process chat turns queued by the UI when CHAT_JOB_QUEUE is enabled.
+# Start as many as analysis load requires; each runs CHAT_JOB_WORKERS turns at a time.
+
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.insert(0, project_root)
+
+from dotenv import load_dotenv
+load_dotenv()
+from chatbot_api import run_chat_job_workers
+
+
+def main():
+    """Start the worker threads and block until interrupted."""
+    worker_count = int(os.environ.get('CHAT_JOB_WORKERS', 4))
+    print(f"Starting chat job worker process with {worker_count} workers...")
+    run_chat_job_workers(worker_count)
+
+
+if __name__ == "__main__":
+    # export GOOGLE_API_KEY="key1,key2,..."
+    # export DATABASE_URL="..."
+    # export R2_ACCOUNT_ID="..."
+    # export R2_ACCESS_KEY_ID="..."
+    # export R2_SECRET_ACCESS_KEY="..."
+    # export R2_BUCKET_NAME="..."
+    main()
@@ -0,0 +1,62 @@
+# Background maintenance for web workers: runs a task on its own thread when asked to, coalescing
+# bursts of requests. Kept free of Flask/database imports; ui.py hands it the task to run.
+
+import time
+import threading
+
+
+class MaintenanceScheduler:
+    """
+    Runs `task` on one daemon thread when asked to. Requests are coalesced: a run starts once
+    no request came in for `debounce_seconds` or the oldest waiting request is `max_delay_seconds`
+    old, and never within `min_interval_seconds` of the previous run's start. A request made
+    while the task runs schedules one more run after it.
+    """
+
+    def __init__(self, task, debounce_seconds, min_interval_seconds, max_delay_seconds=None):
+        self.task = task
+        self.debounce_seconds = debounce_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.max_delay_seconds = max(debounce_seconds, min_interval_seconds if max_delay_seconds is None else max_delay_seconds)
+        self.runs = 0
+        self._condition = threading.Condition()
+        self._first_request = None  # monotonic times of the oldest and newest waiting request
+        self._last_request = None
+        self._last_run = None
+        self._thread = None
+
+    def request(self):
+        """Asks for a run. Returns immediately; the thread is started on first use."""
+        with self._condition:
+            now = time.monotonic()
+            if self._first_request is None:
+                self._first_request = now
+            self._last_request = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_loop, name='maintenance', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _next_run_at(self):
+        run_at = min(self._last_request + self.debounce_seconds, self._first_request + self.max_delay_seconds)
+        if self._last_run is not None:
+            run_at = max(run_at, self._last_run + self.min_interval_seconds)
+        return run_at
+
+    def _run_loop(self):
+        while True:
+            with self._condition:
+                while self._first_request is None:
+                    self._condition.wait()
+                wait_seconds = self._next_run_at() - time.monotonic()
+                if wait_seconds > 0:
+                    self._condition.wait(wait_seconds)
+                    continue
+                self._first_request = self._last_request = None
+                self._last_run = time.monotonic()
+            try:
+                self.task()
+            except Exception as e:
+                print(f"Background maintenance failed: {e}")
+            with self._condition:
+                self.runs += 1
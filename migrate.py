@@ -0,0 +1,29 @@
+# Run after deploying a new version to bring an existing database up to the current schema.
+# New databases are created at the latest version by the app itself and need nothing.
+
+import os
+import sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '.'))
+sys.path.insert(0, project_root)
+
+from dotenv import load_dotenv
+load_dotenv()
+# ui refuses to start on a database with pending migrations, except for this script
+os.environ['ALLOW_PENDING_MIGRATIONS'] = 'true'
+from ui import app, pending_migrations, run_migrations
+
+
+def main():
+    """Apply pending schema migrations within the app context."""
+    with app.app_context():
+        if not pending_migrations():
+            print("Database schema is up to date.")
+            return
+        run_migrations()
+    print("Migrations finished.")
+
+
+if __name__ == "__main__":
+    # export DATABASE_URL="..."
+    main()
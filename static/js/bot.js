@@ -14,6 +14,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- START: State Management ---
     let currentSessionId = null;
+    // Cursor to the page of older messages of the current session, null once all are shown
+    let historyCursor = null;
+    let isLoadingOlderMessages = false;
     // --- END: State Management ---
 
     // --- START: Sidebar Toggle Functionality ---
@@ -93,10 +96,20 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- END: Elegant Confirmation Modal ---
 
     // --- START: Add Message to UI ---
-   const addMessageToChat = (sender, content) => {
+   // With `beforeElement`, the message is inserted above it (older history) without scrolling
+   const addMessageToChat = (sender, content, messageType = null, beforeElement = null) => {
         const messageBubble = document.createElement('div');
         messageBubble.classList.add('message-bubble', `${sender}-message`);
 
+        const placeBubble = () => {
+            if (beforeElement) {
+                chatMessages.insertBefore(messageBubble, beforeElement);
+            } else {
+                chatMessages.appendChild(messageBubble);
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+        };
+
         // Path 1: Content is a file object
         if (typeof content === 'object' && content !== null && content.type === 'file') {
             const fileContainer = document.createElement('div');
@@ -116,8 +129,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (!fileId) {
                     console.error('File ID is missing from content:', content);
                     messageBubble.innerHTML = `<div class="file-error">❌ File data is corrupt. ID missing.</div>`;
-                    chatMessages.appendChild(messageBubble);
-                    chatMessages.scrollTop = chatMessages.scrollHeight;
+                    placeBubble();
                     return messageBubble;
                 }
 
@@ -195,25 +207,65 @@ document.addEventListener('DOMContentLoaded', () => {
             messageBubble.textContent = text;
         }
 
-        chatMessages.appendChild(messageBubble);
-        chatMessages.scrollTop = chatMessages.scrollHeight;
+        placeBubble();
 
         return messageBubble;
     };
 
     // --- END: Add Message to UI ---
 
+    // --- START: Incremental History Loading ---
+    // Sessions open on their latest page of messages; older pages are fetched as the user scrolls up.
+    // Pages are the server's HISTORY_PAGE_SIZE, so no limit is sent
+    const loadOlderMessages = async () => {
+        if (!historyCursor || isLoadingOlderMessages) return;
+        isLoadingOlderMessages = true;
+        const sessionId = currentSessionId;
+        try {
+            const response = await cachedFetch(`/api/sessions/${sessionId}/messages?before=${historyCursor}`);
+            if (!response.ok) throw new Error('Failed to load older messages');
+            const data = await response.json();
+            if (sessionId !== currentSessionId) return; // The user switched sessions meanwhile
+
+            // Keep the messages the user is looking at in place while the page is inserted above them
+            const previousHeight = chatMessages.scrollHeight;
+            const firstMessage = chatMessages.firstChild;
+            data.messages.forEach(msg => addMessageToChat(msg.sender, msg.content, msg.message_type, firstMessage));
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+            historyCursor = data.next_cursor;
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+            historyCursor = null;
+        } finally {
+            isLoadingOlderMessages = false;
+        }
+        // A short page may not fill the view, leaving nothing to scroll
+        if (historyCursor && chatMessages.scrollHeight <= chatMessages.clientHeight) {
+            loadOlderMessages();
+        }
+    };
+
+    chatMessages.addEventListener('scroll', () => {
+        if (chatMessages.scrollTop < 100) {
+            loadOlderMessages();
+        }
+    });
+    // --- END: Incremental History Loading ---
+
 
-   const loadChat = async (sessionId) => {
+   // `firstPage` is the latest page of messages if the caller already has it (from initial-data)
+   const loadChat = async (sessionId, firstPage = null) => {
         hideAILoadingIndicator(); // Hide loading indicator from previous session
         
         showLoadingIndicator(); // This is for loading chat history
         
         try {
-            const response = await fetch(`/api/sessions/${sessionId}`);
-            if (!response.ok) throw new Error('Failed to load messages');
-            
-            const data = await response.json();
+            let data = firstPage;
+            if (!data) {
+                const response = await cachedFetch(`/api/sessions/${sessionId}/messages`);
+                if (!response.ok) throw new Error('Failed to load messages');
+                data = await response.json();
+            }
             console.log('=== LOADING CHAT SESSION ===');
             console.log('Session ID:', sessionId);
             console.log('Backend response:', data);
@@ -222,6 +274,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const messages = data.messages;
             
             currentSessionId = parseInt(sessionId);
+            historyCursor = data.next_cursor;
             chatMessages.innerHTML = '';
             
             messages.forEach((msg, index) => {
@@ -237,6 +290,9 @@ document.addEventListener('DOMContentLoaded', () => {
             });
             
             console.log('=== CHAT LOADING COMPLETE ===');
+            if (historyCursor && chatMessages.scrollHeight <= chatMessages.clientHeight) {
+                loadOlderMessages();
+            }
             
             // Update active state in UI
             document.querySelectorAll('.chat-history-item').forEach(item => {
@@ -293,6 +349,7 @@ document.addEventListener('DOMContentLoaded', () => {
             currentSessionId = newSession.id;
 
             // Clear the chat UI for the new session
+            historyCursor = null;
             chatMessages.innerHTML = '';
 
             // Add the new session to the top of the sidebar UI
@@ -361,7 +418,7 @@ document.addEventListener('DOMContentLoaded', () => {
    const initialLoad = async () => {
         showLoadingIndicator();
         try {
-            const response = await fetch('/api/initial-data');
+            const response = await cachedFetch('/api/initial-data');
             if (!response.ok) {
                 throw new Error('Could not load initial chat data.');
             }
@@ -383,7 +440,7 @@ document.addEventListener('DOMContentLoaded', () => {
             
             // Load the most recent session, or create a new one
             if (data.active_session_id) {
-                loadChat(data.active_session_id);
+                loadChat(data.active_session_id, { messages: data.messages, next_cursor: data.next_cursor });
             } else {
                 createNewChatSession();
             }
@@ -421,6 +478,79 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Text shown in the loading indicator for each progress event of a streamed response
+    const describeProgress = (progress) => {
+        switch (progress.stage) {
+            case 'received': return 'AI is thinking...';
+            case 'generating_code': return 'Writing the analysis code...';
+            case 'code_ready': return 'Loading your data...';
+            case 'executing': return 'Running the analysis...';
+            case 'uploading': return `Preparing ${progress.count} file${progress.count === 1 ? '' : 's'}...`;
+            case 'file_uploaded': return `Prepared ${progress.uploaded} of ${progress.count} files...`;
+            default: return null;
+        }
+    };
+
+    const updateAILoadingText = (text) => {
+        const loadingText = document.querySelector('#loading-indicator .loading-text');
+        if (loadingText && text) {
+            loadingText.textContent = text;
+        }
+    };
+
+    // Read a text/event-stream response, calling onEvent(eventName, data) for every event
+    const readServerSentEvents = async (response, onEvent) => {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data) onEvent(eventName, JSON.parse(data));
+            }
+        }
+    };
+
+    // Wait for a queued chat turn to finish, showing its progress; resolves with its { status, body } result
+    const pollChatJob = async (jobId, signal, onProgress) => {
+        // A single abort listener for the whole poll ends the current wait early
+        let timer = null;
+        let endWait = null;
+        const onAbort = () => {
+            clearTimeout(timer);
+            if (endWait) endWait();
+        };
+        signal.addEventListener('abort', onAbort);
+        try {
+            while (true) {
+                await new Promise((resolve) => {
+                    endWait = resolve;
+                    timer = setTimeout(resolve, 1000);
+                });
+                if (signal.aborted) throw new DOMException('Aborted', 'AbortError');
+                const response = await fetch(`/api/jobs/${jobId}`, { signal: signal });
+                if (!response.ok) throw new Error('Failed to fetch the status of the response.');
+                const job = await response.json();
+                if (job.result) return job.result;
+                if (job.status === 'cancelled') throw new DOMException('Aborted', 'AbortError');
+                if (job.progress) onProgress(job.progress);
+            }
+        } finally {
+            signal.removeEventListener('abort', onAbort);
+        }
+    };
+
     const handleSendMessage = async () => {
         const userMessage = userInput.value.trim();
         
@@ -471,10 +601,12 @@ document.addEventListener('DOMContentLoaded', () => {
             .catch(err => console.error("Error updating session title:", err));
         };
 
+        let chatJobId = null; // Set when the server queues the turn instead of streaming it
+
         try {
             const response = await fetch(`/api/sessions/${messageSessionId}/message`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
                 signal: abortController.signal,
                 body: JSON.stringify({
                     message: userMessage,
@@ -488,7 +620,34 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.response || errorData.error || 'A server error occurred.');
             }
 
-            const botResponseData = await response.json();
+            // Show progress while the answer is being prepared; the last event carries the answer itself
+            let result = null;
+            const showProgress = (progress) => {
+                if (currentSessionId === messageSessionId) {
+                    updateAILoadingText(describeProgress(progress));
+                }
+            };
+            if (response.status === 202) {
+                chatJobId = (await response.json()).job_id;
+                result = await pollChatJob(chatJobId, abortController.signal, showProgress);
+            } else {
+                await readServerSentEvents(response, (eventName, data) => {
+                    if (eventName === 'status') {
+                        showProgress(data);
+                    } else if (eventName === 'result') {
+                        result = data;
+                    }
+                });
+            }
+
+            if (!result) {
+                throw new Error('The response ended unexpectedly.');
+            }
+            if (result.status !== 200) {
+                throw new Error(result.body.response || result.body.error || 'A server error occurred.');
+            }
+
+            const botResponseData = result.body;
 
             // Hide loading indicator if we're viewing this session
             if (currentSessionId === messageSessionId) {
@@ -526,6 +685,12 @@ document.addEventListener('DOMContentLoaded', () => {
                     addMessageToChat('bot', 'Response generation stopped.');
                 }
                 
+                // A queued turn keeps running on the server unless it is cancelled
+                if (chatJobId) {
+                    fetch(`/api/jobs/${chatJobId}/cancel`, { method: 'POST' })
+                        .catch(err => console.error("Error cancelling job:", err));
+                }
+
                 // Log the stop event
                 fetch(`/api/sessions/${messageSessionId}/log-stop`, {
                     method: 'POST',
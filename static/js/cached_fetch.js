@@ -0,0 +1,31 @@
+// Conditional GETs for the JSON endpoints that send ETags. The last response for each URL is kept
+// in sessionStorage and revalidated with If-None-Match, so an unchanged resource costs a 304.
+const CACHED_FETCH_PREFIX = 'cached-fetch:';
+
+async function cachedFetch(url) {
+    let cached = null;
+    try {
+        cached = JSON.parse(sessionStorage.getItem(CACHED_FETCH_PREFIX + url));
+    } catch (error) {
+        cached = null;
+    }
+
+    // Sent by hand, so the browser's own HTTP cache must stay out of the way
+    const headers = cached ? { 'If-None-Match': cached.etag } : {};
+    const response = await fetch(url, { headers, cache: 'no-store' });
+
+    if (response.status === 304 && cached) {
+        return new Response(cached.body, { status: 200, headers: { 'Content-Type': 'application/json' } });
+    }
+
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        try {
+            sessionStorage.setItem(CACHED_FETCH_PREFIX + url, JSON.stringify({ etag, body: await response.clone().text() }));
+        } catch (error) {
+            // Storage full or unavailable: just don't cache
+            console.warn('Could not cache response of', url, error);
+        }
+    }
+    return response;
+}
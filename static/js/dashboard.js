@@ -46,7 +46,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Data Source Management Logic ---
     async function fetchAndDisplayDataSources() {
         try {
-            const response = await fetch('/get_data_sources');
+            const response = await cachedFetch('/get_data_sources');
             const data = await response.json();
             dataSourceList.innerHTML = '';
             if (data.success && data.sources.length > 0) {
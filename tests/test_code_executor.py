@@ -0,0 +1,138 @@
+import pickle
+import threading
+
+import pandas as pd
+import pytest
+
+import code_executor
+from code_executor import CodeExecutorPool, CodeExecutionError, execute_analysis
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / 'data.csv'
+    pd.DataFrame({'a': [1, 2, 3]}).to_csv(path, index=False)
+    return {"path": str(path), "format": "csv", "out_of_core": False, "chunk_rows": 2}
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        kwargs.setdefault('timeout_seconds', 10)
+        pool = CodeExecutorPool(1, **kwargs)
+        pools.append(pool)
+        return pool
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def idle_worker(pool):
+    return pool._idle.queue[0]
+
+
+def test_runs_code_against_the_dataset(make_pool, dataset):
+    pool = make_pool()
+    result = pool.run("print(df['a'].sum())\nresult_df = df[df['a'] > 1]", dataset, "q")
+
+    assert result['printed_output'] == '6'
+    assert [name for name, _ in result['dataframes']] == ['result_df']
+
+
+def test_out_of_core_dataset_is_read_in_chunks(make_pool, dataset):
+    pool = make_pool()
+    result = pool.run("print(sum(len(chunk) for chunk in read_chunks()))", dict(dataset, out_of_core=True), "q")
+
+    assert result['printed_output'] == '3'
+
+
+def test_error_in_code_keeps_the_worker(make_pool, dataset):
+    pool = make_pool()
+    worker = idle_worker(pool)
+    with pytest.raises(CodeExecutionError, match="ZeroDivisionError"):
+        pool.run("1 / 0", dataset, "q")
+
+    assert idle_worker(pool) is worker
+
+
+def test_timeout_replaces_the_worker(make_pool, dataset):
+    pool = make_pool(timeout_seconds=1)
+    worker = idle_worker(pool)
+    with pytest.raises(CodeExecutionError, match="longer than 1 seconds"):
+        pool.run("import time\ntime.sleep(30)", dataset, "q")
+
+    assert idle_worker(pool) is not worker
+    assert worker.process.poll() is not None
+    # The replacement's first reply includes its own startup, so give it longer
+    pool.timeout_seconds = 10
+    assert pool.run("print(len(df))", dataset, "q")['printed_output'] == '3'
+
+
+def test_dead_worker_is_replaced(make_pool, dataset):
+    pool = make_pool()
+    worker = idle_worker(pool)
+    with pytest.raises(CodeExecutionError, match="ran out of memory"):
+        pool.run("import os\nos._exit(1)", dataset, "q")
+
+    assert idle_worker(pool) is not worker
+    assert pool.run("print(len(df))", dataset, "q")['printed_output'] == '3'
+
+
+@pytest.mark.skipif(code_executor.resource is None, reason="memory limits need the resource module")
+def test_memory_limit_stops_the_job(make_pool, dataset):
+    pool = make_pool(memory_limit_bytes=2 << 30)
+    with pytest.raises(CodeExecutionError, match="ran out of memory"):
+        pool.run("x = bytearray(8 << 30)", dataset, "q")
+
+    # The worker survives a MemoryError and takes the next job
+    assert pool.run("print(len(df))", dataset, "q")['printed_output'] == '3'
+
+
+def test_worker_is_recycled_after_max_jobs(make_pool, dataset):
+    pool = make_pool(max_jobs_per_worker=2)
+    worker = idle_worker(pool)
+    pool.run("pass", dataset, "q")
+    assert idle_worker(pool) is worker
+
+    pool.run("pass", dataset, "q")
+    assert idle_worker(pool) is not worker
+
+
+def test_garbled_reply_replaces_the_worker(make_pool, dataset, monkeypatch):
+    pool = make_pool()
+    worker = idle_worker(pool)
+
+    def garbled_load(stream):
+        raise pickle.UnpicklingError("invalid load key")
+    monkeypatch.setattr(code_executor.pickle, 'load', garbled_load)
+    with pytest.raises(CodeExecutionError, match="UnpicklingError"):
+        pool.run("pass", dataset, "q")
+    monkeypatch.undo()
+
+    assert idle_worker(pool) is not worker
+    assert pool.run("print(len(df))", dataset, "q")['printed_output'] == '3'
+
+
+def test_concurrent_in_process_runs_keep_their_own_figures():
+    df = pd.DataFrame({'a': [1, 2, 3]})
+    code = "import time\nplt.figure()\nplt.plot(df['a'])\nplt.title(question)\ntime.sleep(0.5)"
+    execute_analysis(code, df, 'warm-up')  # So both threads reach their sleep together
+    results = {}
+
+    def run(question):
+        results[question] = execute_analysis(code, df, question)
+    threads = [threading.Thread(target=run, args=(question,)) for question in ('first', 'second')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [len(results[question]['figures']) for question in ('first', 'second')] == [1, 1]
+
+
+def test_pool_is_refused_without_posix(monkeypatch):
+    monkeypatch.setattr(code_executor.os, 'name', 'nt')
+    with pytest.raises(RuntimeError, match="POSIX"):
+        CodeExecutorPool(1, timeout_seconds=10)
@@ -0,0 +1,99 @@
+import time
+import threading
+
+from maintenance import MaintenanceScheduler
+
+
+def wait_for_runs(scheduler, runs, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while scheduler.runs < runs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return scheduler.runs
+
+
+def recording_scheduler(debounce_seconds, min_interval_seconds, max_delay_seconds=None):
+    started = []
+    scheduler = MaintenanceScheduler(lambda: started.append(time.monotonic()), debounce_seconds,
+                                     min_interval_seconds, max_delay_seconds)
+    return scheduler, started
+
+
+def test_burst_of_requests_runs_once():
+    scheduler, started = recording_scheduler(debounce_seconds=0.2, min_interval_seconds=0)
+    for _ in range(10):
+        scheduler.request()
+        time.sleep(0.02)
+
+    assert wait_for_runs(scheduler, 1) == 1
+    time.sleep(0.4)
+    assert scheduler.runs == 1
+
+
+def test_run_waits_for_debounce_after_last_request():
+    scheduler, started = recording_scheduler(debounce_seconds=0.3, min_interval_seconds=0, max_delay_seconds=5)
+    scheduler.request()
+    time.sleep(0.2)
+    last_request = time.monotonic()
+    scheduler.request()
+
+    assert wait_for_runs(scheduler, 1) == 1
+    assert started[0] - last_request >= 0.3
+
+
+def test_steady_requests_run_by_max_delay():
+    scheduler, started = recording_scheduler(debounce_seconds=0.3, min_interval_seconds=0, max_delay_seconds=0.6)
+    first_request = time.monotonic()
+    while scheduler.runs == 0 and time.monotonic() - first_request < 3:
+        scheduler.request()
+        time.sleep(0.1)
+
+    assert scheduler.runs == 1
+    assert 0.6 <= started[0] - first_request < 1.0
+
+
+def test_runs_are_min_interval_apart():
+    scheduler, started = recording_scheduler(debounce_seconds=0.05, min_interval_seconds=0.8)
+    scheduler.request()
+    assert wait_for_runs(scheduler, 1) == 1
+
+    scheduler.request()
+    time.sleep(0.4)
+    assert scheduler.runs == 1
+    assert wait_for_runs(scheduler, 2) == 2
+    assert started[1] - started[0] >= 0.8
+
+
+def test_request_during_run_schedules_one_more_run():
+    release = threading.Event()
+    running = threading.Event()
+
+    def task():
+        running.set()
+        release.wait(5)
+
+    scheduler = MaintenanceScheduler(task, debounce_seconds=0.05, min_interval_seconds=0)
+    scheduler.request()
+    assert running.wait(5)
+    running.clear()
+    for _ in range(3):
+        scheduler.request()
+    release.set()
+
+    assert wait_for_runs(scheduler, 2) == 2
+    time.sleep(0.3)
+    assert scheduler.runs == 2
+
+
+def test_failing_task_does_not_stop_the_scheduler():
+    calls = []
+
+    def task():
+        calls.append(1)
+        raise RuntimeError("R2 is down")
+
+    scheduler = MaintenanceScheduler(task, debounce_seconds=0.05, min_interval_seconds=0)
+    scheduler.request()
+    assert wait_for_runs(scheduler, 1) == 1
+    scheduler.request()
+    assert wait_for_runs(scheduler, 2) == 2
+    assert len(calls) == 2
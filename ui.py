@@ -1,6 +1,6 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session, Response, stream_with_context
 from flask_cors import CORS
 import os
 import random
@@ -8,30 +8,44 @@ import smtplib
 import ssl
 from email.message import EmailMessage
 import time
+from datetime import datetime, timedelta, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 import re
+import io
+import json
 import requests
+from requests.adapters import HTTPAdapter
+import queue
 from werkzeug.utils import secure_filename
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tempfile
 
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_auth_requests
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func as sqlalchemy_func
+from sqlalchemy import func as sqlalchemy_func, text as sqlalchemy_text, event as sqlalchemy_event
 
 import boto3
 from botocore.exceptions import ClientError
 import uuid
 from functools import wraps
 import sys
-import subprocess
 
 import threading
+from maintenance import MaintenanceScheduler
 from dotenv import load_dotenv
 load_dotenv()
 
 ############## SETUP DB, CLOUDFARE ##################################################################################
 
+# chatbot_api imports this module as `ui`; when it is run as a script that must be this module,
+# not a second copy with its own app and database
+if __name__ == '__main__':
+    sys.modules.setdefault('ui', sys.modules[__name__])
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'your_super_secret_key_default_fallback_change_me')
 app.config.update(
@@ -98,6 +112,9 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     google_id = db.Column(db.String(255), unique=True, nullable=True)
+    # Bumped whenever the user's sessions, messages, files or data sources change; drives the ETags
+    # of the read endpoints. NULL (rows from before the column existed) counts as 0.
+    data_version = db.Column(db.Integer, nullable=True, default=0)
     
     # Relationships
     chat_sessions = db.relationship('ChatSession', backref='user', lazy=True, cascade="all, delete-orphan")
@@ -114,9 +131,15 @@ class ChatSession(db.Model):
     created_at = db.Column(db.DateTime, server_default=sqlalchemy_func.now())
     updated_at = db.Column(db.DateTime, server_default=sqlalchemy_func.now(), onupdate=sqlalchemy_func.now())
     
+    __table_args__ = (
+        db.Index('ix_chat_sessions_user_id_updated_at', 'user_id', 'updated_at'),
+        db.Index('ix_chat_sessions_user_id_created_at', 'user_id', 'created_at'),
+    )
+
     # Relationships
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade="all, delete-orphan")
     generated_files = db.relationship('GeneratedFile', backref='session', lazy=True, cascade="all, delete-orphan")
+    chat_jobs = db.relationship('ChatJob', backref='session', lazy=True, cascade="all, delete-orphan")
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
@@ -128,19 +151,30 @@ class ChatMessage(db.Model):
     is_stopped = db.Column(db.Boolean, nullable=False, default=False)
     is_file_info = db.Column(db.Boolean, nullable=False, default=False)
 
+    __table_args__ = (
+        db.Index('ix_chat_messages_session_id_timestamp', 'session_id', 'timestamp'),
+        db.Index('ix_chat_messages_session_id_id', 'session_id', 'id'), # History pages (see _load_message_page)
+    )
+
 class DataSource(db.Model):
     __tablename__ = 'data_sources'
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     storage_path = db.Column(db.String(1024), nullable=False, unique=True) # Path in cloud storage
+    columnar_path = db.Column(db.String(1024), nullable=True) # Parquet copy of the upload, if one could be written
+    profile = db.Column(db.Text, nullable=True) # JSON schema/profile built at upload time (see build_data_profile)
     file_type = db.Column(db.String(50), nullable=False, default='csv') # e.g., 'csv', 'gsheet'
     created_at = db.Column(db.DateTime, server_default=sqlalchemy_func.now())
 
+    __table_args__ = (
+        db.Index('ix_data_sources_user_id_created_at', 'user_id', 'created_at'),
+    )
+
 class GeneratedFile(db.Model):
     __tablename__ = 'generated_files'
     id = db.Column(db.Integer, primary_key=True)
-    chat_session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id', ondelete='CASCADE'), nullable=False)
+    chat_session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id', ondelete='CASCADE'), nullable=False, index=True)
     message_index = db.Column(db.Integer, nullable=True)  # Index of the message in the session
     original_prompt = db.Column(db.Text, nullable=False) # The user prompt that created the file
     file_type = db.Column(db.String(50), nullable=False) # e.g., 'png', 'csv'
@@ -149,10 +183,165 @@ class GeneratedFile(db.Model):
     created_at = db.Column(db.DateTime, server_default=sqlalchemy_func.now())
     intro_message = db.Column(db.Text, nullable=True)
 
+class ChatJob(db.Model):
+    __tablename__ = 'chat_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id', ondelete='CASCADE'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True) # 'queued', 'running', 'done', 'failed' or 'cancelled'
+    payload = db.Column(db.Text, nullable=False) # JSON request for the chatbot API
+    progress = db.Column(db.Text, nullable=True) # JSON of the latest progress event
+    result = db.Column(db.Text, nullable=True) # JSON {"status", "body"} of the finished turn
+    claimed_at = db.Column(db.Float, nullable=True) # time.time() when a worker picked the job up
+    finished_at = db.Column(db.Float, nullable=True)
+    created_at = db.Column(db.DateTime, server_default=sqlalchemy_func.now())
+
+class CachedCode(db.Model):
+    __tablename__ = 'code_cache'
+    cache_key = db.Column(db.String(64), primary_key=True) # sha256 of normalized question, schema and model
+    generated_code = db.Column(db.Text, nullable=False)
+    cached_at = db.Column(db.Float, nullable=False, index=True) # time.time() when stored, for the TTL
+
+class CachedResult(db.Model):
+    __tablename__ = 'result_cache'
+    cache_key = db.Column(db.String(64), primary_key=True) # sha256 of data source ETag and generated code
+    printed_output = db.Column(db.Text, nullable=False)
+    artifacts = db.Column(db.Text, nullable=False) # JSON list of {"file_type", "storage_path", "intro_message"}
+    cached_at = db.Column(db.Float, nullable=False, index=True) # time.time() when stored, for the TTL
+
+@sqlalchemy_event.listens_for(db.session, 'after_flush')
+def _collect_changed_users(flush_session, flush_context):
+    """Remembers every user whose chat data a flush changed, for _bump_data_versions."""
+    user_ids, chat_session_ids = set(), set()
+    for obj in list(flush_session.new) + list(flush_session.dirty) + list(flush_session.deleted):
+        if isinstance(obj, (ChatSession, DataSource)):
+            user_ids.add(obj.user_id)
+        elif isinstance(obj, ChatMessage):
+            chat_session_ids.add(obj.session_id)
+        elif isinstance(obj, GeneratedFile):
+            chat_session_ids.add(obj.chat_session_id)
+    chat_session_ids.discard(None)
+    if chat_session_ids:
+        # Core statement on the flush's connection; ORM queries would try to flush again
+        sessions_table = ChatSession.__table__
+        user_ids.update(flush_session.connection().execute(db.select(sessions_table.c.user_id)
+                                                           .where(sessions_table.c.id.in_(chat_session_ids))).scalars())
+    user_ids.discard(None)
+    flush_session.info.setdefault('changed_user_ids', set()).update(user_ids)
+
+@sqlalchemy_event.listens_for(db.session, 'before_commit')
+def _bump_data_versions(commit_session):
+    """
+    Bumps users.data_version of the users changed in this transaction. Done at commit rather than
+    at each flush, so the users rows are locked only for the commit, not for the whole turn.
+    """
+    commit_session.flush()  # before_commit runs ahead of the commit's own flush
+    user_ids = commit_session.info.pop('changed_user_ids', None)
+    if user_ids:
+        users_table = User.__table__
+        commit_session.connection().execute(users_table.update().where(users_table.c.id.in_(user_ids))
+                                            .values(data_version=sqlalchemy_func.coalesce(users_table.c.data_version, 0) + 1))
+
+@sqlalchemy_event.listens_for(db.session, 'after_rollback')
+def _forget_changed_users(rollback_session):
+    rollback_session.info.pop('changed_user_ids', None)
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True) # One row per applied entry of SCHEMA_MIGRATIONS
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, server_default=sqlalchemy_func.now())
+
+def _postgres_index_is_valid(connection, index_name):
+    """True or False for an index's pg_index.indisvalid, None if there is no such index."""
+    return connection.execute(sqlalchemy_text(
+        'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'WHERE c.relname = :name AND pg_table_is_visible(c.oid)'), {"name": index_name}).scalar()
+
+def _create_indexes(connection, *index_names):
+    """
+    Creates indexes declared on the models above in an existing database. On PostgreSQL
+    they are built CONCURRENTLY, so the tables stay writable while that runs. A failed or
+    interrupted concurrent build leaves an INVALID index that IF NOT EXISTS would skip, so
+    such an index is dropped and rebuilt, and the build is checked before it counts as done.
+    """
+    is_postgres = connection.dialect.name == 'postgresql'
+    concurrently = 'CONCURRENTLY ' if is_postgres else ''
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in index_names:
+                continue
+            if is_postgres and _postgres_index_is_valid(connection, index.name) is False:
+                print(f"Index {index.name} is invalid, rebuilding it")
+                connection.execute(sqlalchemy_text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+            columns = ', '.join(column.name for column in index.columns)
+            connection.execute(sqlalchemy_text(f'CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {table.name} ({columns})'))
+            if is_postgres and not _postgres_index_is_valid(connection, index.name):
+                raise RuntimeError(f"Index {index.name} was not built; run the migration again")
+            print(f"Index {index.name} is in place")
+
+def _add_columns(connection, *qualified_names):
+    """Adds nullable columns declared on the models above ("table.column") that a table doesn't have yet."""
+    inspector = db.inspect(connection)
+    for qualified_name in qualified_names:
+        table_name, column_name = qualified_name.split('.')
+        if column_name in {column['name'] for column in inspector.get_columns(table_name)}:
+            continue
+        column_type = db.metadata.tables[table_name].columns[column_name].type.compile(dialect=connection.dialect)
+        connection.execute(sqlalchemy_text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+        print(f"Added column {qualified_name}")
+
+HOT_PATH_INDEXES = (
+    'ix_chat_messages_session_id_timestamp', 'ix_chat_messages_session_id_id',
+    'ix_chat_sessions_user_id_updated_at', 'ix_chat_sessions_user_id_created_at',
+    'ix_generated_files_chat_session_id', 'ix_data_sources_user_id_created_at', 'ix_chat_jobs_session_id',
+)
+
+# Changes to databases created before the models declared them, in order: (version, description, function
+# taking an autocommit connection). db.create_all() already builds a new database at the latest version.
+SCHEMA_MIGRATIONS = [
+    (1, "Indexes for chat history, session list, generated file and data source queries",
+     lambda connection: _create_indexes(connection, *HOT_PATH_INDEXES)),
+    (2, "Columns for data source Parquet copies and profiles, and users.data_version for ETags",
+     lambda connection: _add_columns(connection, 'data_sources.columnar_path', 'data_sources.profile', 'users.data_version')),
+]
+
+def pending_migrations():
+    applied = {row.version for row in db.session.query(SchemaVersion.version)}
+    return [migration for migration in SCHEMA_MIGRATIONS if migration[0] not in applied]
+
+def run_migrations():
+    """Applies the schema migrations this database doesn't have yet (see migrate.py)."""
+    for version, description, migrate in pending_migrations():
+        print(f"Applying migration {version}: {description}")
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            migrate(connection)
+        db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
+
+def _stamp_migrations():
+    """Records every migration as applied, for a database db.create_all() just built."""
+    try:
+        db.session.add_all(SchemaVersion(version=version, description=description)
+                           for version, description, _ in pending_migrations())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()  # Another worker stamped it first
+
+# Set by migrate.py, which has to import this module to bring an out-of-date database up to date
+ALLOW_PENDING_MIGRATIONS = os.environ.get('ALLOW_PENDING_MIGRATIONS', 'false').lower() == 'true'
+
 # --- Database Initialization ---
 # This command creates all the tables defined above if they don't exist.
 with app.app_context():
+    is_new_database = not db.inspect(db.engine).has_table(ChatSession.__tablename__)
     db.create_all()
+    if is_new_database:
+        _stamp_migrations()
+    elif pending_migrations() and not ALLOW_PENDING_MIGRATIONS:
+        # Not applied here: index builds on large tables would hold up every worker's startup. Serving
+        # anyway would fail every query on a column the models have and the database doesn't yet
+        versions = ', '.join(str(version) for version, _, _ in pending_migrations())
+        raise RuntimeError(f"Database schema is missing migrations {versions}; run `python migrate.py` first")
     print("SQLAlchemy database initialized successfully.")
 
 ############## END SETUP DB, CLOUDFARE ##################################################################################
@@ -178,44 +367,126 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def _clean_stopped_messages(messages, s3_client):
+def _linked_file_id(message):
+    """The GeneratedFile id a file message points to, or None if its link is malformed."""
+    try:
+        return int(message.message_content)
+    except ValueError:
+        return None
+
+def _load_linked_files(messages):
+    """Fetches the GeneratedFile rows of all file messages in one query, keyed by id."""
+    file_ids = {_linked_file_id(m) for m in messages if m.is_file_info} - {None}
+    if not file_ids:
+        return {}
+    return {f.id: f for f in GeneratedFile.query.filter(GeneratedFile.id.in_(file_ids)).all()}
+
+def _serialize_messages(messages):
+    """Turns chat messages into the dicts the frontend renders, with their files loaded in one query."""
+    files_by_id = _load_linked_files(messages)
+
+    messages_data = []
+    for m in messages:
+        if m.message_type == 'user':
+            sender = "user"
+        else:
+            sender = "bot"
+
+        if m.is_file_info:
+            file_id = _linked_file_id(m)
+            gen_file = files_by_id.get(file_id)
+            if file_id is None:
+                messages_data.append({"sender": "bot", "content": f"[Error: Malformed file link ({m.message_content})]", "message_type": "error"})
+            elif gen_file and not gen_file.is_deleted:
+                file_obj = {"id": gen_file.id, "type": "file", "file_type": gen_file.file_type, "storage_path": gen_file.storage_path, "is_deleted": False, "intro_message": gen_file.intro_message}
+                messages_data.append({"sender": sender, "content": file_obj, "message_type": "file"})
+            elif gen_file and gen_file.is_deleted:
+                file_obj = {"id": gen_file.id, "type": "file", "is_deleted": True}
+                messages_data.append({"sender": "bot", "content": file_obj, "message_type": "file"})
+            else:
+                messages_data.append({"sender": "bot", "content": f"[Error: File with ID {file_id} not found or was deleted.]", "message_type": "error"})
+        else:
+            messages_data.append({"sender": sender, "content": m.message_content, "message_type": "text"})
+    return messages_data
+
+def _stopped_turn_indices(messages):
     """
-    Finds and deletes messages/files around a "stopped" event from the DB and R2.
-    Returns True if deletions occurred, otherwise False.
+    Indices of the bot messages of stopped turns: those between a "stopped" event and the
+    user messages around it. The stop event itself is kept.
     """
     indices_to_delete,  stop_indices = set(), set()
-
-    # 1. Identify all messages that need to be deleted
     for i, msg in enumerate(messages):
         if msg.is_stopped:
             start_index = next((j for j in range(i - 1, -1, -1) if messages[j].message_type == 'user'), -1)
             end_index = next((j for j in range(i + 1, len(messages)) if messages[j].message_type == 'user'), len(messages))
             indices_to_delete.update(range(start_index + 1, end_index))
             stop_indices.add(i)
+    return indices_to_delete - stop_indices
 
-    indices_to_delete = indices_to_delete - stop_indices
+def _clean_stopped_messages(messages, s3_client):
+    """
+    Finds and deletes messages/files around a "stopped" event from the DB and R2.
+    Returns the indices of the deleted messages.
+    """
+    # 1. Identify all messages that need to be deleted
+    indices_to_delete = _stopped_turn_indices(messages)
 
     if indices_to_delete:
         messages_to_delete = [messages[i] for i in sorted(list(indices_to_delete), reverse=True)]
-        # 2. Delete associated files from R2 and records from the database
+        # 2. Delete associated files from R2 (one batched request) and records from the database
+        files_to_delete = list(_load_linked_files(messages_to_delete).values())
+        for gen_file in files_to_delete:
+            db.session.delete(gen_file)
+        if files_to_delete:
+            try:
+                s3_client.delete_objects(Bucket=R2_BUCKET_NAME,
+                                         Delete={'Objects': [{'Key': f.storage_path} for f in files_to_delete]})
+            except Exception as e:
+                # cleanup_r2_orphans removes them later
+                print(f"Could not delete files of stopped messages from R2: {e}")
         for msg_to_delete in messages_to_delete:
-            if msg_to_delete.is_file_info:
-                try:
-                    file_id = int(msg_to_delete.message_content)
-                    gen_file = GeneratedFile.query.get(file_id)
-                    if gen_file:
-                        db.session.delete(gen_file)
-                        s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=gen_file.storage_path)
-                except Exception as e:
-                    print(f"Could not process/delete file for message {msg_to_delete.id}: {e}")
             db.session.delete(msg_to_delete)
         # 3. Commit all deletions
         db.session.commit()
     return indices_to_delete
 
+def _load_message_page(session_id, before=None, limit=50):
+    """
+    Returns up to `limit` of a session's newest messages with an id below `before`, oldest
+    first, and the cursor for the page before them (None when there is none). A page starts
+    at a user message where possible, so a turn isn't split across pages.
+    """
+    query = ChatMessage.query.filter_by(session_id=session_id)
+    if before is not None:
+        query = query.filter(ChatMessage.id < before)
+    page = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+    has_more = len(page) > limit
+    page = page[:limit][::-1]
+    if has_more:
+        # The messages before the first turn start go to the next page, with the rest of their turn
+        turn_start = next((i for i, m in enumerate(page) if m.message_type == 'user'), 0)
+        page = page[turn_start:]
+    return page, (page[0].id if has_more else None)
+
+def _without_stopped_turns(messages):
+    """
+    Drops what's left of stopped turns, e.g. files a turn saved after it was stopped,
+    without deleting anything; reconcile_stopped_turns removes them for good.
+    """
+    hidden = _stopped_turn_indices(messages)
+    return [m for i, m in enumerate(messages) if i not in hidden]
+
+def _clean_stopped_turn(session_id):
+    """Deletes the messages and files of a session's latest turn if it was stopped."""
+    last_user_message = (ChatMessage.query.filter_by(session_id=session_id, message_type='user')
+                         .order_by(ChatMessage.id.desc()).first())
+    query = ChatMessage.query.filter_by(session_id=session_id)
+    if last_user_message:
+        query = query.filter(ChatMessage.id >= last_user_message.id)
+    return len(_clean_stopped_messages(query.order_by(ChatMessage.id.asc()).all(), s3_client))
+
 def cleanup_db_orphans():
     """Deletes ChatMessage and GeneratedFile records not linked to any ChatSession."""
-    from ui import db, ChatSession, ChatMessage, GeneratedFile
     print("--- Starting Database Cleanup ---")
     
     # Find and delete orphaned ChatMessages
@@ -243,9 +514,35 @@ def cleanup_db_orphans():
     print("--- Finished Database Cleanup ---\n")
 
 
+def reconcile_stopped_turns(max_age_seconds=2 * 24 * 3600):
+    """
+    Deletes messages and files that stopped turns saved after the stop was logged (a turn
+    keeps running on the chatbot API until it finishes), for stops in the last max_age_seconds.
+    """
+    print("--- Starting Stopped Turn Cleanup ---")
+    # Timestamps are stored by the database in UTC, without a time zone
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=max_age_seconds)
+    session_ids = [row.session_id for row in db.session.query(ChatMessage.session_id)
+                   .filter(ChatMessage.is_stopped.is_(True), ChatMessage.timestamp >= cutoff).distinct()]
+    deleted = 0
+    for session_id in session_ids:
+        messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.id.asc()).all()
+        deleted += len(_clean_stopped_messages(messages, s3_client))
+    print(f"Deleted {deleted} messages of stopped turns in {len(session_ids)} sessions.")
+    print("--- Finished Stopped Turn Cleanup ---\n")
+
+
+def cleanup_finished_chat_jobs(max_age_seconds=24 * 3600):
+    """Deletes chat jobs that finished more than max_age_seconds ago."""
+    print("--- Starting Chat Job Cleanup ---")
+    deleted = ChatJob.query.filter(ChatJob.finished_at < time.time() - max_age_seconds).delete()
+    db.session.commit()
+    print(f"Deleted {deleted} finished chat jobs.")
+    print("--- Finished Chat Job Cleanup ---\n")
+
+
 def cleanup_r2_orphans():
     """Deletes files from Cloudflare R2 that are not in the GeneratedFile table."""
-    from ui import db, GeneratedFile
     print("--- Starting Cloudflare R2 Cleanup ---")
     
     # 1. Get all file paths from the database
@@ -287,8 +584,59 @@ def cleanup_r2_orphans():
     print("--- Finished Cloudflare R2 Cleanup ---")
 
 
+# Orphan cleanup after deletions waits for MAINTENANCE_DEBOUNCE_SECONDS without a new deletion
+# (but no more than MAINTENANCE_MIN_INTERVAL_SECONDS), and runs at most once per
+# MAINTENANCE_MIN_INTERVAL_SECONDS in each worker. cleanup.py stays the full nightly pass.
+MAINTENANCE_DEBOUNCE_SECONDS = float(os.environ.get('MAINTENANCE_DEBOUNCE_SECONDS', 30))
+MAINTENANCE_MIN_INTERVAL_SECONDS = float(os.environ.get('MAINTENANCE_MIN_INTERVAL_SECONDS', 600))
+
+def run_orphan_cleanup():
+    """Removes records and R2 files left behind by deleted sessions."""
+    with app.app_context():
+        cleanup_db_orphans()
+        cleanup_r2_orphans()
+
+maintenance_scheduler = MaintenanceScheduler(run_orphan_cleanup, MAINTENANCE_DEBOUNCE_SECONDS,
+                                             MAINTENANCE_MIN_INTERVAL_SECONDS)
+
+
 ############## API ENDPOINTS ##################################################################################
 
+# Queue chat turns in the chat_jobs table for job_worker.py instead of calling the chatbot API directly
+CHAT_JOB_QUEUE = os.environ.get('CHAT_JOB_QUEUE', 'false').lower() == 'true'
+
+# How post_message reaches the chat pipeline: 'http' calls CHATBOT_API_URL, 'inprocess' runs
+# chatbot_api.run_chat_turn in this process, skipping the loopback hop and the JSON round-trip
+CHATBOT_API_MODE = os.environ.get('CHATBOT_API_MODE', 'http').lower()
+
+# Keep-alive connections to the chatbot API, shared by all requests of this worker
+chatbot_api_session = requests.Session()
+_chatbot_api_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(os.environ.get('CHATBOT_API_POOL_SIZE', 10)))
+chatbot_api_session.mount('http://', _chatbot_api_adapter)
+chatbot_api_session.mount('https://', _chatbot_api_adapter)
+
+def _data_etag(user_id, *parts):
+    """
+    Strong ETag for a read of the user's chat data: changes whenever users.data_version does,
+    and differs per endpoint and arguments (`parts`). Costs one primary-key lookup.
+    """
+    version = db.session.query(User.data_version).filter_by(id=user_id).scalar() or 0
+    return '-'.join(str(part) for part in (user_id, version) + parts)
+
+def _not_modified(etag):
+    response = Response(status=304)
+    return _with_etag(response, etag)
+
+def _with_etag(response, etag):
+    response.set_etag(etag)
+    # Browsers may keep it, but must check with If-None-Match before using it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Messages per page of session history, and the most a client may ask for
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = 200
+
 
 # Replace the get_session_details function in your main Flask app
 
@@ -296,47 +644,44 @@ def cleanup_r2_orphans():
 @login_required
 def get_session_details(session_id):
     """
-    Loads messages for a specific session after cleaning up any "stopped" events.
+    Loads all messages of a specific session, leaving out those of stopped turns.
     """
     user_id = session['user_id']
     chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first_or_404()
+
+    etag = _data_etag(user_id, 'session', chat_session.id)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
     
-    # Initial fetch of messages
     messages = ChatMessage.query.filter_by(session_id=chat_session.id).order_by(ChatMessage.timestamp.asc()).all()
+    messages = _without_stopped_turns(messages)
+
+    messages_data = _serialize_messages(messages)
     
-    # Call the helper to clean the messages; it returns True if changes were made
-    deleted_indices = _clean_stopped_messages(messages, s3_client)
+    return _with_etag(jsonify({"messages": messages_data}), etag)
 
-    messages_data = []
-    for i, m in enumerate(messages):
 
-        if i in deleted_indices:
-            continue
-    
-        if m.message_type == 'user':
-            sender = "user"
-        else:
-            sender = "bot"
-        
-        if m.is_file_info:
-            try:
-                file_id = int(m.message_content)
-                gen_file = GeneratedFile.query.get(file_id)
-                
-                if gen_file and not gen_file.is_deleted:
-                    file_obj = {"id": gen_file.id, "type": "file", "file_type": gen_file.file_type, "storage_path": gen_file.storage_path, "is_deleted": False, "intro_message": gen_file.intro_message}
-                    messages_data.append({"sender": sender, "content": file_obj, "message_type": "file"})
-                elif gen_file and gen_file.is_deleted:
-                    file_obj = {"id": gen_file.id, "type": "file", "is_deleted": True}
-                    messages_data.append({"sender": "bot", "content": file_obj, "message_type": "file"})
-                else:
-                    messages_data.append({"sender": "bot", "content": f"[Error: File with ID {file_id} not found or was deleted.]", "message_type": "error"})
-            except ValueError:
-                messages_data.append({"sender": "bot", "content": f"[Error: Malformed file link ({m.message_content})]", "message_type": "error"})
-        else:
-            messages_data.append({"sender": sender, "content": m.message_content, "message_type": "text"})
-    
-    return jsonify({"messages": messages_data})
+@app.route('/api/sessions/<int:session_id>/messages', methods=['GET'])
+@login_required
+def get_session_messages(session_id):
+    """
+    Loads one page of a session's messages, newest first: without `before` the latest
+    `limit` messages, then older pages by passing the previous response's `next_cursor`.
+    """
+    user_id = session['user_id']
+    chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first_or_404()
+
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE_SIZE)
+
+    etag = _data_etag(user_id, 'messages', chat_session.id, before, limit)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
+    messages, next_cursor = _load_message_page(chat_session.id, before, limit)
+    messages = _without_stopped_turns(messages)
+
+    return _with_etag(jsonify({"messages": _serialize_messages(messages), "next_cursor": next_cursor}), etag)
 
 
 @app.route('/api/sessions', methods=['GET'])
@@ -346,12 +691,16 @@ def get_all_sessions():
     Gets all chat sessions for the current user.
     """
     user_id = session['user_id']
+    etag = _data_etag(user_id, 'sessions')
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
     sessions = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.created_at.desc()).all()
-    return jsonify([{
+    return _with_etag(jsonify([{
         "id": s.id,
         "title": s.session_title,
         "created_at": s.created_at.isoformat()
-    } for s in sessions])
+    } for s in sessions]), etag)
 
 @app.route('/api/sessions', methods=['POST'])
 @login_required
@@ -398,43 +747,8 @@ def delete_session(session_id):
         # 4. Commit the changes.
         db.session.commit()
 
-        # 5. Run the full cleanup in a background thread to avoid delaying the response
-        def run_cleanup_in_background():
-            """Run your existing cleanup file that already works."""
-            print("Starting background cleanup after session deletion...")
-            
-            try:
-                cleanup_file = 'cleanup.py'
-                
-                current_dir = os.path.dirname(os.path.abspath(__file__))
-                cleanup_path = os.path.join(current_dir, cleanup_file)
-                
-                if not os.path.exists(cleanup_path):
-                    print(f"Cleanup file not found: {cleanup_path}")
-                    return
-                
-                # Run your existing cleanup file
-                result = subprocess.run([
-                    sys.executable, 
-                    cleanup_path
-                ], capture_output=True, text=True, timeout=60)
-                
-                if result.returncode == 0:
-                    print("Background cleanup finished successfully.")
-                    if result.stdout:
-                        print(result.stdout)
-                else:
-                    print(f"Background cleanup failed: {result.stderr}")
-                    
-            except subprocess.TimeoutExpired:
-                print("Background cleanup timed out after 60 seconds.")
-            except Exception as e:
-                print(f"Error running background cleanup: {e}")
-
-        # Start the cleanup
-        cleanup_thread = threading.Thread(target=run_cleanup_in_background)
-        cleanup_thread.daemon = True
-        cleanup_thread.start()
+        # 5. Sweep up anything left behind; deletions in quick succession share one cleanup run
+        maintenance_scheduler.request()
     
         return jsonify({"message": "Session and all associated files deleted successfully"}), 200
 
@@ -450,6 +764,7 @@ def post_message(session_id):
     """
     Handles a message by acting as a client to the external Chatbot API.
     It now aggregates all generated files into a single response.
+    Clients that accept text/event-stream get the API's progress events as they happen.
     """
     user_id = session['user_id']
     chat_session = ChatSession.query.filter_by(id=session_id, user_id=user_id).first_or_404()
@@ -463,7 +778,7 @@ def post_message(session_id):
         return jsonify({"error": "Message and data_source_id are required"}), 400
 
     chatbot_api_url = os.environ.get('CHATBOT_API_URL')
-    if not chatbot_api_url:
+    if not chatbot_api_url and not CHAT_JOB_QUEUE and CHATBOT_API_MODE != 'inprocess':
         return jsonify({"error": "Chatbot API service is not configured on the server."}), 500
 
     data_source = DataSource.query.filter_by(id=csv_file_id, user_id=user_id).first()
@@ -477,38 +792,43 @@ def post_message(session_id):
     api_payload = {
         'message': user_prompt,
         'data_source_path': data_source.storage_path,
+        'columnar_path': data_source.columnar_path,
+        'data_profile': json.loads(data_source.profile) if data_source.profile else None,
         'model': model_type,
         'session_id': chat_session.id,
         'user_prompt': user_prompt
     }
 
+    if CHAT_JOB_QUEUE:
+        # Hand the turn to the job workers; the frontend polls /api/jobs/<id> for the result
+        chat_job = ChatJob(session_id=chat_session.id, payload=json.dumps(api_payload))
+        db.session.add(chat_job)
+        db.session.commit()
+        return jsonify({"job_id": chat_job.id}), 202
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        if CHATBOT_API_MODE == 'inprocess':
+            events = _stream_chat_turn_in_process(api_payload)
+        else:
+            events = _relay_chatbot_events(chatbot_api_url, api_payload)
+        return Response(stream_with_context(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if CHATBOT_API_MODE == 'inprocess':
+        result = _run_chat_turn_in_process(api_payload)
+        if result["status"] != 200:
+            return jsonify(result["body"]), result["status"]
+        return jsonify(_to_frontend_response(result["body"])), 200
+
     try:
         # We assume the external API can take a while, so a long timeout is appropriate
-        api_response = requests.post(chatbot_api_url, json=api_payload, timeout=300)
+        api_response = chatbot_api_session.post(chatbot_api_url, json=api_payload, timeout=300)
         api_response.raise_for_status()
         
         response_data = api_response.json()
 
-        # Create a structured response object for the frontend
-        bot_response_to_frontend = {
-            "text": response_data.get("response", ""),
-            "files": []
-        }
-
-        # If the API generated files, add them to the files array
-        if response_data.get("generated_files"):
-            for file_info in response_data["generated_files"]:
-                bot_response_to_frontend["files"].append({
-                    "type": "file",
-                    "file_id": file_info['file_id'],
-                    "name": file_info['name'],
-                    "intro_message": file_info.get('intro_message', 'Here is the generated file:'),
-                    "is_deleted": False,
-                    "file_type": file_info.get('file_type', 'unknown')
-                })
-
         # Return the complete, structured response
-        return jsonify(bot_response_to_frontend), 200
+        return jsonify(_to_frontend_response(response_data)), 200
 
     except requests.exceptions.RequestException as e:
         print(f"Error calling chatbot API: {e}")
@@ -518,6 +838,147 @@ def post_message(session_id):
         return jsonify({"error": "An unexpected error occurred while processing the request."}), 500
 
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_chat_job(job_id):
+    """Status of a queued chat turn, with its latest progress event and, once finished, its result."""
+    user_id = session['user_id']
+    chat_job = ChatJob.query.join(ChatSession).filter(ChatJob.id == job_id, ChatSession.user_id == user_id).first_or_404()
+
+    job_data = {
+        "job_id": chat_job.id,
+        "status": chat_job.status,
+        "progress": json.loads(chat_job.progress) if chat_job.progress else None,
+        "result": None
+    }
+    if chat_job.result:
+        result = json.loads(chat_job.result)
+        if result["status"] == 200:
+            result["body"] = _to_frontend_response(result["body"])
+        job_data["result"] = result
+    return jsonify(job_data), 200
+
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_chat_job(job_id):
+    """Cancel a queued or running chat turn. A running turn stops at its next step and saves nothing."""
+    user_id = session['user_id']
+    chat_job = ChatJob.query.join(ChatSession).filter(ChatJob.id == job_id, ChatSession.user_id == user_id).first_or_404()
+
+    ChatJob.query.filter(ChatJob.id == chat_job.id, ChatJob.status.in_(['queued', 'running'])).update(
+        {'status': 'cancelled', 'finished_at': time.time()}, synchronize_session=False)
+    db.session.commit()
+    return jsonify({"message": "Job cancelled"}), 200
+
+
+def _to_frontend_response(response_data):
+    """Turn a chatbot API response into the structured response the frontend renders."""
+    bot_response_to_frontend = {
+        "text": response_data.get("response", ""),
+        "files": []
+    }
+
+    # If the API generated files, add them to the files array
+    if response_data.get("generated_files"):
+        for file_info in response_data["generated_files"]:
+            bot_response_to_frontend["files"].append({
+                "type": "file",
+                "file_id": file_info['file_id'],
+                "name": file_info['name'],
+                "intro_message": file_info.get('intro_message', 'Here is the generated file:'),
+                "is_deleted": False,
+                "file_type": file_info.get('file_type', 'unknown')
+            })
+    return bot_response_to_frontend
+
+
+def _run_chat_turn_in_process(api_payload):
+    """Run a chat turn in this process and return its final {"status", "body"} result."""
+    try:
+        with chatbot_api.app.app_context():
+            for event, payload in chatbot_api.run_chat_turn(api_payload):
+                if event == 'result':
+                    return payload
+        raise ValueError("The chat turn finished without a result.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return {"status": 500, "body": {"error": "An unexpected error occurred while processing the request."}}
+
+
+def _stream_chat_turn_in_process(api_payload):
+    """
+    Stream a chat turn run in this process as server-sent events, like _relay_chatbot_events.
+    The turn runs on its own thread and app context; if the browser disconnects it stops at
+    its next step without saving anything.
+    """
+    events = queue.Queue()
+    stopped = threading.Event()
+
+    def run_turn():
+        try:
+            with chatbot_api.app.app_context():
+                turn = chatbot_api.run_chat_turn(api_payload)
+                for event, payload in turn:
+                    events.put((event, payload))
+                    if event == 'result' or stopped.is_set():
+                        break
+                turn.close()
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            events.put(('result', {"status": 500, "body": {"error": "An unexpected error occurred while processing the request."}}))
+
+    yield _format_sse('status', {"stage": "received"})
+    threading.Thread(target=run_turn, daemon=True).start()
+    try:
+        while True:
+            event, payload = events.get()
+            if event == 'result':
+                if payload["status"] == 200:
+                    payload = {"status": 200, "body": _to_frontend_response(payload["body"])}
+                yield _format_sse('result', payload)
+                return
+            yield _format_sse(event, payload)
+    finally:
+        stopped.set()
+
+
+def _format_sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _relay_chatbot_events(chatbot_api_url, api_payload):
+    """
+    Stream a chat turn from the chatbot API as server-sent events. Progress ('status') events
+    are passed through as they arrive; the final 'result' event carries the frontend response
+    in the same shape as the non-streaming endpoint, or an error with its HTTP status.
+    """
+    yield _format_sse('status', {"stage": "received"})
+    try:
+        with chatbot_api_session.post(chatbot_api_url, json=api_payload, stream=True, timeout=(10, 300),
+                           headers={'Accept': 'text/event-stream'}) as api_response:
+            api_response.raise_for_status()
+            event = 'message'
+            for line in api_response.iter_lines(decode_unicode=True):
+                if line.startswith('event:'):
+                    event = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    payload = json.loads(line[len('data:'):])
+                    if event == 'result':
+                        if payload["status"] == 200:
+                            payload = {"status": 200, "body": _to_frontend_response(payload["body"])}
+                        yield _format_sse('result', payload)
+                        return
+                    yield _format_sse(event, payload)
+        raise ValueError("The chatbot service closed the stream without a result.")
+    except requests.exceptions.RequestException as e:
+        print(f"Error calling chatbot API: {e}")
+        yield _format_sse('result', {"status": 503, "body": {"error": f"Could not connect to the chatbot service: {e}"}})
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        yield _format_sse('result', {"status": 500, "body": {"error": "An unexpected error occurred while processing the request."}})
+
+
 @app.route('/api/files/<int:file_id>', methods=['DELETE'])
 @login_required
 def delete_file(file_id):
@@ -599,14 +1060,18 @@ def download_file(file_id):
 @login_required
 def get_initial_data():
     """
-    Provides all necessary data for the initial load and cleans up any
-    "stopped" events from the most recent session.
+    Provides all necessary data for the initial load, with the latest page
+    of messages of the most recent session.
     """
     user_id = session.get('user_id')
     if not user_id:
         return jsonify({"error": "User not authenticated"}), 401
 
     try:
+        etag = _data_etag(user_id, 'initial-data', HISTORY_PAGE_SIZE)
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
+
         data_sources = DataSource.query.filter_by(user_id=user_id).order_by(DataSource.created_at.desc()).all()
         sessions_list = ChatSession.query.filter_by(user_id=user_id).order_by(ChatSession.updated_at.desc()).all()
 
@@ -614,50 +1079,25 @@ def get_initial_data():
         sessions_data = [{"id": s.id, "title": s.session_title} for s in sessions_list]
 
         messages_data = []
+        next_cursor = None
         active_session_id = None
         if sessions_list:
             active_session_id = sessions_list[0].id
-            messages = ChatMessage.query.filter_by(session_id=active_session_id).order_by(ChatMessage.timestamp.asc()).all()
-            
-            deleted_indices = _clean_stopped_messages(messages, s3_client)
+            # Only the latest page; older messages are fetched from get_session_messages on scroll
+            messages, next_cursor = _load_message_page(active_session_id, limit=HISTORY_PAGE_SIZE)
+            messages = _without_stopped_turns(messages)
 
             # Process the final, clean list of messages for the frontend
-            for i, m in enumerate(messages):
-
-                if i in deleted_indices:
-                    continue
-
-                if m.message_type == 'user':
-                    sender = "user"
-                else:
-                    sender = "bot"
-                
-                if m.is_file_info:
-                    try:
-                        file_id = int(m.message_content)
-                        gen_file = GeneratedFile.query.get(file_id)
-                        
-                        if gen_file and not gen_file.is_deleted:
-                            file_obj = {"id": gen_file.id, "type": "file", "file_type": gen_file.file_type, "is_deleted": False,
-                                        "storage_path": gen_file.storage_path, "intro_message": gen_file.intro_message}
-                            messages_data.append({"sender": sender, "content": file_obj, "message_type": "file"})
-                        elif gen_file and gen_file.is_deleted:
-                            file_obj = {"id": gen_file.id, "type": "file", "is_deleted": True}
-                            messages_data.append({"sender": "bot", "content": file_obj, "message_type": "file"})
-                        else:
-                            messages_data.append({"sender": "bot", "content": f"[Error: File with ID {file_id} not found or was deleted.]", "message_type": "error"})
-                    except ValueError:
-                        messages_data.append({"sender": "bot", "content": f"[Error: Malformed file link ({m.message_content})]", "message_type": "error"})
-                else:
-                    messages_data.append({"sender": sender, "content": m.message_content, "message_type": "text"})
+            messages_data = _serialize_messages(messages)
         
         response = {
             "data_sources": datasources_data, 
             "sessions": sessions_data, 
             "messages": messages_data, 
+            "next_cursor": next_cursor,
             "active_session_id": active_session_id
         }
-        return jsonify(response)
+        return _with_etag(jsonify(response), etag)
 
     except Exception as e:
         db.session.rollback()
@@ -675,10 +1115,6 @@ def log_generation_stopped(session_id):
 
     db.session.expire_all()
 
-    chatbot_api_url = os.environ.get('CHATBOT_API_URL')
-    if not chatbot_api_url:
-        return jsonify({"error": "Chatbot API service is not configured on the server."}), 500
-
     stopped_message = ChatMessage(
         session_id=chat_session.id,
         message_type='bot',
@@ -688,6 +1124,10 @@ def log_generation_stopped(session_id):
     db.session.add(stopped_message)
     db.session.commit()
 
+    # Delete what the turn saved so far; anything it saves later is hidden from reads
+    # and removed by reconcile_stopped_turns
+    _clean_stopped_turn(chat_session.id)
+
     return jsonify({"message": "Stop event logged and cleanup performed"}), 200
 
 @app.route('/api/sessions/<int:session_id>/log-error', methods=['POST'])
@@ -803,6 +1243,7 @@ def delete_account():
         # 2. Get a list of all files uploaded by this user from the data_sources table
         # The `user_to_delete.data_sources` uses the SQLAlchemy relationship we defined.
         files_to_delete_from_r2 = [ds.storage_path for ds in user_to_delete.data_sources]
+        files_to_delete_from_r2.extend(ds.columnar_path for ds in user_to_delete.data_sources if ds.columnar_path)
         
         # We also need to find and delete all AI-generated files from their chat sessions
         for chat_session in user_to_delete.chat_sessions:
@@ -878,6 +1319,191 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+PROFILE_SAMPLE_ROWS = 3
+PROFILE_MAX_VALUE_LENGTH = 60
+
+def _json_scalar(value):
+    """Converts a pandas/numpy scalar into something json.dumps accepts."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, str) and len(value) > PROFILE_MAX_VALUE_LENGTH:
+        return value[:PROFILE_MAX_VALUE_LENGTH] + '...'
+    return value
+
+def _is_ranged(dtype):
+    """Whether min/max are meaningful for a column: numeric or datetime, but not boolean."""
+    return ((pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype))
+            and not pd.api.types.is_bool_dtype(dtype))
+
+def build_data_profile(df, column_stats=True):
+    """
+    Summarizes a DataFrame for code generation: row count, and per column the
+    dtype, null count, cardinality and min/max (numeric and datetime columns),
+    plus a few sample rows. With column_stats=False (for a partial sample of
+    the data) only dtypes and sample rows are included.
+    """
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        column = {"name": str(name), "dtype": str(series.dtype)}
+        if not column_stats:
+            columns.append(column)
+            continue
+        column["null_count"] = int(series.isna().sum())
+        column["distinct_count"] = int(series.nunique(dropna=True))
+        if _is_ranged(series.dtype) and series.notna().any():
+            column["min"] = _json_scalar(series.min())
+            column["max"] = _json_scalar(series.max())
+        columns.append(column)
+
+    sample_rows = [
+        {str(key): _json_scalar(value) for key, value in row.items()}
+        for row in df.head(PROFILE_SAMPLE_ROWS).to_dict(orient='records')
+    ]
+    return {"row_count": len(df) if column_stats else None, "columns": columns, "sample_rows": sample_rows}
+
+# Data sources bigger than this are streamed in chunks instead of loaded into one DataFrame, both when
+# they are uploaded and when the chatbot analyzes them. 0 disables.
+OUT_OF_CORE_THRESHOLD_BYTES = int(os.environ.get('OUT_OF_CORE_THRESHOLD_BYTES', 1024 ** 3))
+OUT_OF_CORE_CHUNK_ROWS = int(os.environ.get('OUT_OF_CORE_CHUNK_ROWS', 100_000))
+# Distinct values counted per column when profiling chunk by chunk; past it the count is a lower bound
+PROFILE_MAX_DISTINCT_VALUES = 10_000
+
+class ChunkedProfileBuilder:
+    """
+    Builds the profile of build_data_profile from a DataFrame's chunks, one at a time. Columns whose
+    dtype differs between chunks get the dtype pandas would give their concatenation.
+    """
+
+    def __init__(self):
+        self.row_count = 0
+        self.columns = {}
+        self.sample_rows = None
+
+    def add(self, chunk):
+        if self.sample_rows is None:
+            self.sample_rows = build_data_profile(chunk.head(PROFILE_SAMPLE_ROWS), column_stats=False)['sample_rows']
+        self.row_count += len(chunk)
+        for name in chunk.columns:
+            series = chunk[name]
+            stats = self.columns.get(name)
+            if stats is None:
+                stats = self.columns[name] = {"dtype": series.dtype, "null_count": 0, "distinct": set(), "min": None, "max": None}
+            elif stats["dtype"] != series.dtype:
+                stats["dtype"] = pd.concat([pd.Series(dtype=stats["dtype"]), pd.Series(dtype=series.dtype)]).dtype
+            stats["null_count"] += int(series.isna().sum())
+            if stats["distinct"] is not None:
+                stats["distinct"].update(series.dropna().unique())
+                if len(stats["distinct"]) > PROFILE_MAX_DISTINCT_VALUES:
+                    stats["distinct"] = None
+            if _is_ranged(stats["dtype"]) and series.notna().any():
+                low, high = series.min(), series.max()
+                stats["min"] = low if stats["min"] is None else min(stats["min"], low)
+                stats["max"] = high if stats["max"] is None else max(stats["max"], high)
+
+    def profile(self):
+        columns = []
+        for name, stats in self.columns.items():
+            column = {"name": str(name), "dtype": str(stats["dtype"]), "null_count": stats["null_count"]}
+            if stats["distinct"] is None:
+                column["distinct_count"] = PROFILE_MAX_DISTINCT_VALUES
+                column["distinct_count_capped"] = True
+            else:
+                column["distinct_count"] = len(stats["distinct"])
+            if _is_ranged(stats["dtype"]) and stats["min"] is not None:
+                column["min"] = _json_scalar(stats["min"])
+                column["max"] = _json_scalar(stats["max"])
+            columns.append(column)
+        return {"row_count": self.row_count, "columns": columns, "sample_rows": self.sample_rows or []}
+
+def _process_large_uploaded_csv(file_stream, storage_path):
+    """
+    _process_uploaded_csv for uploads over OUT_OF_CORE_THRESHOLD_BYTES: one pass over the CSV in
+    chunks of OUT_OF_CORE_CHUNK_ROWS rows builds the profile and writes the Parquet copy to a
+    temporary file, so memory is bounded by the chunk size. If a later chunk's types don't fit the
+    Parquet schema taken from the first one, only the profile is kept.
+    """
+    profile = ChunkedProfileBuilder()
+    with tempfile.TemporaryFile() as parquet_file:
+        writer = None
+        write_parquet = True
+        try:
+            file_stream.seek(0)
+            for chunk in pd.read_csv(file_stream, chunksize=OUT_OF_CORE_CHUNK_ROWS):
+                profile.add(chunk)
+                if not write_parquet:
+                    continue
+                try:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(parquet_file, table.schema)
+                    writer.write_table(table)
+                except Exception as e:
+                    print(f"Could not write columnar copy of {storage_path}: {e}")
+                    write_parquet = False
+                    if writer:
+                        writer.close()
+            if write_parquet and writer:
+                writer.close()
+        except Exception as e:
+            print(f"Could not parse uploaded CSV {storage_path}: {e}")
+            return None, None
+        profile_json = json.dumps(profile.profile())
+
+        columnar_path = None
+        if write_parquet and writer:
+            try:
+                parquet_file.seek(0)
+                columnar_path = f"{storage_path}.parquet"
+                s3_client.upload_fileobj(parquet_file, R2_BUCKET_NAME, columnar_path,
+                                         ExtraArgs={'ContentType': 'application/vnd.apache.parquet'})
+            except Exception as e:
+                print(f"Could not write columnar copy of {storage_path}: {e}")
+                columnar_path = None
+    return columnar_path, profile_json
+
+def _process_uploaded_csv(file_stream, storage_path):
+    """
+    Parses an uploaded CSV once to build its profile and a typed Parquet copy,
+    stored next to it in R2 so the chatbot can skip CSV parsing. Returns
+    (columnar_path, profile_json); either is None if it could not be produced,
+    in which case the chatbot falls back to reading the CSV itself.
+    """
+    file_stream.seek(0, os.SEEK_END)
+    if OUT_OF_CORE_THRESHOLD_BYTES > 0 and file_stream.tell() > OUT_OF_CORE_THRESHOLD_BYTES:
+        return _process_large_uploaded_csv(file_stream, storage_path)
+    try:
+        file_stream.seek(0)
+        df = pd.read_csv(file_stream)
+    except Exception as e:
+        print(f"Could not parse uploaded CSV {storage_path}: {e}")
+        return None, None
+
+    profile_json = None
+    try:
+        profile_json = json.dumps(build_data_profile(df))
+    except Exception as e:
+        print(f"Could not build profile of {storage_path}: {e}")
+
+    columnar_path = None
+    try:
+        parquet_buffer = io.BytesIO()
+        df.to_parquet(parquet_buffer, index=False)
+        parquet_buffer.seek(0)
+
+        columnar_path = f"{storage_path}.parquet"
+        s3_client.upload_fileobj(parquet_buffer, R2_BUCKET_NAME, columnar_path,
+                                 ExtraArgs={'ContentType': 'application/vnd.apache.parquet'})
+    except Exception as e:
+        print(f"Could not write columnar copy of {storage_path}: {e}")
+        columnar_path = None
+
+    return columnar_path, profile_json
+
 @app.route('/upload_data', methods=['POST'])
 def upload_data_file():
     if 'file' not in request.files:
@@ -908,12 +1534,15 @@ def upload_data_file():
                 R2_BUCKET_NAME, # The name of your bucket
                 unique_filename # The unique path/name for the file in the bucket
             )
+            columnar_path, profile_json = _process_uploaded_csv(file.stream, unique_filename)
 
             # Save the metadata to your PostgreSQL database
             new_data_source = DataSource(
                 user_id=user_id,
                 original_filename=filename,
                 storage_path=unique_filename, # Store the unique name, not a local path
+                columnar_path=columnar_path,
+                profile=profile_json,
                 file_type='csv'
             )
             db.session.add(new_data_source)
@@ -948,8 +1577,10 @@ def delete_data_source(data_source_id):
         return jsonify({"success": False, "error": "Data source not found"}), 404
 
     try:
-        # Delete the object from the R2 bucket
+        # Delete the object (and its columnar copy) from the R2 bucket
         s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=data_source.storage_path)
+        if data_source.columnar_path:
+            s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=data_source.columnar_path)
         
         # Delete the record from the database
         db.session.delete(data_source)
@@ -975,6 +1606,10 @@ def get_data_sources():
         return jsonify({"success": False, "error": "Unauthorized"}), 401
     
     user_id = session['user_id']
+    etag = _data_etag(user_id, 'data-sources')
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
     sources = DataSource.query.filter_by(user_id=user_id).order_by(DataSource.created_at.desc()).all()
     
     source_list = [{
@@ -985,7 +1620,7 @@ def get_data_sources():
         "storage_path": source.storage_path
     } for source in sources]
     
-    return jsonify({"success": True, "sources": source_list})
+    return _with_etag(jsonify({"success": True, "sources": source_list}), etag)
 
 
 ########### END UPLOAD DELETE FILE DASHBOARD #################################################################################
@@ -1451,6 +2086,13 @@ def google_callback():
 ########### END LOG IN ######################################################################################################
 
 
+if CHATBOT_API_MODE == 'inprocess':
+    # Imported last, because chatbot_api imports this module, and before the first request,
+    # because the app can't take new blueprints once it has served one
+    import chatbot_api
+    app.register_blueprint(chatbot_api.metrics_blueprint)
+
+
 if __name__ == '__main__':
     # Set these environment variables before running the app
     # Example for development (replace with your actual values):